@@ -32,20 +32,10 @@ import numpy as np
 import PeakFinder as pf
 import pylab as pl
 from matplotlib.colors import hsv_to_rgb
+# difference function shared with Periodicity
+from Periodicity import amdf
 
 
-def amdf(x, mindelay = 0, maxdelay = None):
-    nx = len(x)
-    if maxdelay is None:
-        maxdelay = nx
-        
-    y = np.zeros(nx)
-    for i in range(mindelay,maxdelay):
-        n = nx - i
-        y[i] = (np.abs(x[0:nx-i]-x[i:])).sum()/n
-    
-    return y
-
 # I will try to update this object so that data required for the initialisation of every instance stays in the caller. Thee caller passes itself as argument to the callee
 
 class Periodicity(object):
@@ -103,7 +93,7 @@ class Periodicity(object):
 
         
         try:
-            if self.method is 'amdf':
+            if self.method == 'amdf':
                 xc = amdf(xw)
             
                 maxxc = max(xc)
@@ -111,7 +101,7 @@ class Periodicity(object):
                 xcpos = (maxxc-xc[self.mindelay:self.maxdelay]) / maxxc
                 xcth  = self.threshold
                 
-            elif self.method is 'xcorr':
+            elif self.method == 'xcorr':
                 
                 xc = np.correlate(xw,xw,"full") / self.wind
                 xcred = xc[nwind-1+self.mindelay:nwind-1+self.maxdelay]
@@ -231,7 +221,7 @@ class PeriodTimeSeries(object):
         Arguments: (None)
         """
         
-        if self.method is 'xcorr':
+        if self.method == 'xcorr':
             w = self.wind
             self.wnorm = np.correlate(w,w,"full")
         else:
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  AnalysisCache.py
+#
+#  On-disk cache of analysis results
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+"""
+Content-addressed cache of analysis results.
+
+Results are stored in PVFile containers named after a SHA-1 hash of
+the analysed samples and of the analysis parameters, so that the
+same signal analysed with the same settings is only computed once.
+The cache is bounded in size: when it grows beyond the limit, the
+least recently used files are removed. Files are written under a
+temporary name and renamed when complete, and the directory is
+locked during lookups and updates, so that a cache can be shared
+by several worker processes.
+"""
+
+import os
+import json
+import time
+import hashlib
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # no locking on systems without fcntl
+    fcntl = None
+
+import PVAnalysis as pv
+import PVFile
+from Periodicity import PeriodSeries
+
+# samples hashed at a time
+HASH_BLOCK = 1 << 20
+
+SUFFIX = '.pvf'
+LOCKNAME = '.lock'
+
+# part of every key: increase it whenever a change in the analysis
+# code changes its results, so that older entries are not used
+CACHE_VERSION = 2
+
+
+def hash_signal(x, sha=None):
+    '''
+    Update (or create) a SHA-1 hash object with the samples of x
+    (numpy array or SoundUtils.MappedSignal), converted to float
+    Blocks of samples are read one at a time, so that file-backed
+    signals are never loaded entirely
+    '''
+
+    if sha is None:
+        sha = hashlib.sha1()
+    nx = len(x)
+    sha.update(str(nx).encode('ascii'))
+    for st in range(0, nx, HASH_BLOCK):
+        block = np.ascontiguousarray(x[st:st+HASH_BLOCK], dtype='<f8')
+        sha.update(block.tobytes())
+    return sha
+
+
+def _param_value(val):
+    if isinstance(val, np.generic):
+        return val.item()
+    if isinstance(val, np.ndarray):
+        arr = np.ascontiguousarray(val, dtype='<f8')
+        return 'sha1:' + hashlib.sha1(arr.tobytes()).hexdigest()
+    return val
+
+
+def _load_pv(filename):
+    '''
+    Peaks (with their memory map open), times and number of frames
+    of a file saved with PVFile.save_pv
+    '''
+    pvf = PVFile.PVFile(filename)
+    return pvf.get_frames(), np.array(pvf.get_time()), pvf.nframes
+
+
+class _DirLock(object):
+    '''
+    Advisory lock on a cache directory (context manager)
+    '''
+    def __init__(self, dirname, exclusive=True):
+        self.filename = os.path.join(dirname, LOCKNAME)
+        self.exclusive = exclusive
+        self.f = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.f = open(self.filename, 'a')
+            if self.exclusive:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+            else:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *args):
+        if self.f is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+            self.f.close()
+            self.f = None
+
+
+class AnalysisCache(object):
+    def __init__(self, cachedir, maxsize=2**30):
+        '''
+        Cache of analysis results in directory cachedir
+        Arguments:
+            * cachedir = directory for the cached files
+                         (created if needed)
+            * maxsize  = maximum total size of the cached files in bytes
+                         (no limit if None)
+        '''
+
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        if not os.path.isdir(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError:
+                # created by another process in the meantime
+                if not os.path.isdir(cachedir):
+                    raise
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, kind, x, params):
+        '''
+        Hash of the cache and file format versions, the kind of
+        analysis, its parameters and the samples of signal x.
+        Arrays in params are replaced by their own hash
+        '''
+
+        params = dict((key, _param_value(val))
+                      for key, val in params.items())
+        sha = hashlib.sha1()
+        sha.update('{}.{}:'.format(CACHE_VERSION,
+                                   PVFile.VERSION).encode('ascii'))
+        sha.update(kind.encode('ascii'))
+        sha.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        hash_signal(x, sha)
+        return kind + '-' + sha.hexdigest()
+
+    def get_filename(self, key):
+        return os.path.join(self.cachedir, key + SUFFIX)
+
+    def lookup(self, key, opener):
+        '''
+        Load the cached file for key with opener(filename)
+        Returns None if key is not in the cache
+        The file can be evicted by another process as soon as lookup
+        returns, so opener must read everything it needs (or open
+        its memory maps, which stay valid)
+        '''
+
+        filename = self.get_filename(key)
+        with _DirLock(self.cachedir, exclusive=False):
+            try:
+                res = opener(filename)
+            except (IOError, OSError, ValueError):
+                # missing or unreadable file
+                res = None
+            else:
+                # mark as recently used
+                os.utime(filename, None)
+
+        if res is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return res
+
+    def store(self, key, writer, obj):
+        '''
+        Save obj in the cache under key with writer(filename, obj)
+        and evict old files if the cache is too large
+        '''
+
+        filename = self.get_filename(key)
+        # unique name, in case other processes compute the same result
+        tmpname = '{}.{}.{}.part'.format(filename, os.getpid(),
+                                         int(time.time()*1e6))
+        try:
+            writer(tmpname, obj)
+            with _DirLock(self.cachedir):
+                os.rename(tmpname, filename)
+                self._evict()
+        finally:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
+    def _evict(self):
+        '''
+        Remove least recently used files until the cache fits in
+        maxsize. Called with the directory locked
+        '''
+
+        if self.maxsize is None:
+            return
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.cachedir):
+            if not name.endswith(SUFFIX):
+                continue
+            filename = os.path.join(self.cachedir, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, filename))
+            total += st.st_size
+
+        entries.sort()
+        for mtime, size, filename in entries:
+            if total <= self.maxsize:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            total -= size
+
+    def get_size(self):
+        '''
+        Total size of the cached files in bytes
+        '''
+        return sum(os.path.getsize(os.path.join(self.cachedir, name))
+                   for name in os.listdir(self.cachedir)
+                   if name.endswith(SUFFIX))
+
+    def clear(self):
+        '''
+        Remove all cached files
+        '''
+        with _DirLock(self.cachedir):
+            for name in os.listdir(self.cachedir):
+                if name.endswith(SUFFIX):
+                    os.remove(os.path.join(self.cachedir, name))
+
+    def pv(self, x, sr, **pv_args):
+        '''
+        PVAnalysis.PV object with the analysis of signal x,
+        taken from the cache or computed with run_pv
+        Arguments:
+            * x, sr   = signal and sampling rate
+            * pv_args = other keyword arguments for PVAnalysis.PV
+        '''
+
+        mypv = pv.PV(x, sr, **pv_args)
+        params = dict(sr=mypv.sr, nfft=mypv.nfft, hop=mypv.hop,
+                      npeaks=mypv.npeaks, peakthresh=mypv.peakthresh,
+                      window=mypv.win)
+        key = self.get_key('pv', x, params)
+
+        res = self.lookup(key, _load_pv)
+        if res is None:
+            mypv.run_pv()
+            self.store(key, PVFile.save_pv, mypv)
+        else:
+            mypv.peaks, mypv.t, mypv.nframes = res
+        return mypv
+
+    def period_series(self, x, sr, **ps_args):
+        '''
+        Periodicity.PeriodSeries object with the periodicity
+        candidates of signal x, taken from the cache or computed
+        with calc
+        Arguments:
+            * x, sr   = signal and sampling rate
+            * ps_args = other keyword arguments for PeriodSeries
+        '''
+
+        ps = PeriodSeries(x, sr=sr, **ps_args)
+        params = dict(sr=ps.sr, window=np.asarray(ps.wind), hop=ps.hop,
+                      mindelay=ps.mindelay, maxdelay=ps.maxdelay,
+                      method=ps.method, threshold=ps.threshold,
+                      vthresh=ps.vthresh, ncand=ps.ncand,
+                      cand_method=ps.cand_method, fftthresh=ps.fftthresh)
+        key = self.get_key('periodseries', x, params)
+
+        periods = self.lookup(
+            key, lambda fn: PVFile.PeriodSeriesFile(fn).get_periods(ps))
+        if periods is None:
+            ps.calc()
+            self.store(key, PVFile.save_period_series, ps)
+        else:
+            ps.periods = periods
+        return ps
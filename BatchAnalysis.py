@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  BatchAnalysis.py
+#
+#  Run the phase vocoder analysis on many sound files
+#  using a pool of worker processes
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+"""
+Batch analysis of sound files: PV analysis, partial tracking
+and (optionally) f0 estimation, with results saved to disk
+"""
+
+import os
+import sys
+import glob
+import time
+import hashlib
+import multiprocessing
+import numpy as np
+
+import PVAnalysis as pv
+from Periodicity import PeriodSeries
+from SoundUtils import WavMemmap
+from AnalysisCache import AnalysisCache
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+def get_output_name(filename, outdir):
+    '''
+    Name of the result file for a sound file
+    The name of the sound file is followed by a short hash of its
+    absolute path, so that files with the same name in different
+    directories have different results
+    '''
+    base = os.path.splitext(os.path.basename(filename))[0]
+    path = os.path.abspath(filename)
+    if not isinstance(path, bytes):
+        path = path.encode('utf-8')
+    tag = hashlib.sha1(path).hexdigest()[:8]
+    return os.path.join(outdir, '{}-{}.npz'.format(base, tag))
+
+
+def save_results(outfile, mypv, ss, ps=None):
+    '''
+    Save the PV analysis, the partials and optionally the f0
+    estimation in a numpy .npz file
+    '''
+
+    # peaks of all frames one after the other (PVAnalysis.PeakFrames)
+    res = dict(sr=mypv.sr, nfft=mypv.nfft, hop=mypv.hop, t=mypv.t,
+               peaks=mypv.peaks.peaks, offsets=mypv.peaks.offsets)
+
+    # partials are stored one after the other
+    store = ss.partial
+    res['part_start'] = np.array(store.start, dtype=int)
+    res['part_len'] = np.array(store.npts, dtype=int)
+    for field in ['f', 'mag', 'ph', 'realph']:
+        res['part_' + field] = store.get_column(field)
+
+    if ps is not None:
+        res['f0_t'] = ps.get_times()
+        res['f0'] = ps.get_f0()
+        res['f0_strength'] = ps.get_strength()
+
+    # write to a temporary file first, so that incomplete results
+    # are never left with the final name
+    tmpfile = outfile + '.tmp.npz'
+    np.savez(tmpfile, **res)
+    os.rename(tmpfile, outfile)
+
+
+def analyse_file(filename, outdir, pv_args={}, track_args={}, f0_args=None,
+                 cachedir=None, cachesize=2**30):
+    '''
+    Analyse a single WAV file and save the results in outdir
+    Arguments:
+        * filename   = WAV file to analyse
+        * outdir     = directory for the results
+        * pv_args    = keyword arguments for PVAnalysis.PV
+        * track_args = keyword arguments for PV.toSinSum
+        * f0_args    = keyword arguments for Periodicity.PeriodSeries
+                       (no f0 estimation if None)
+        * cachedir   = directory of an AnalysisCache for the PV and
+                       f0 analyses (no cache if None)
+        * cachesize  = maximum size of the cache in bytes
+    Returns the name of the result file
+    '''
+
+    sr, x = WavMemmap(filename)
+
+    if cachedir is not None:
+        cache = AnalysisCache(cachedir, maxsize=cachesize)
+        mypv = cache.pv(x, sr, **pv_args)
+    else:
+        cache = None
+        mypv = pv.PV(x, sr, **pv_args)
+        mypv.run_pv()
+    ss = mypv.toSinSum(**track_args)
+
+    if f0_args is None:
+        ps = None
+    elif cache is not None:
+        ps = cache.period_series(x, sr, **f0_args)
+    else:
+        ps = PeriodSeries(x, sr=sr, **f0_args)
+        ps.calc()
+
+    outfile = get_output_name(filename, outdir)
+    save_results(outfile, mypv, ss, ps)
+    return outfile
+
+
+def _analyse_task(args):
+    '''
+    Worker function: analyse a file and report time and errors
+    '''
+    filename = args[0]
+    t0 = time.time()
+    try:
+        outfile = analyse_file(*args)
+        error = None
+    except Exception as e:
+        outfile = None
+        error = '{}: {}'.format(type(e).__name__, e)
+    return filename, outfile, time.time() - t0, error
+
+
+def analyse_files(files, outdir, nproc=None, pv_args={}, track_args={},
+                  f0_args=None, overwrite=False, cachedir=None,
+                  cachesize=2**30):
+    '''
+    Analyse many WAV files in a pool of processes
+    Arguments:
+        * files      = list of file names or glob pattern
+        * outdir     = directory for the results
+        * nproc      = number of processes (default: number of CPUs)
+        * pv_args    = keyword arguments for PVAnalysis.PV
+        * track_args = keyword arguments for PV.toSinSum
+        * f0_args    = keyword arguments for Periodicity.PeriodSeries
+                       (no f0 estimation if None)
+        * overwrite  = analyse files that already have results
+        * cachedir   = directory of an AnalysisCache shared by the
+                       workers (no cache if None)
+        * cachesize  = maximum size of the cache in bytes
+    Returns a list of (filename, result file, time, error) for each
+    file, in order of completion. Failed files have result None
+    and an error message.
+    '''
+
+    if isinstance(files, basestring):
+        files = sorted(glob.glob(files))
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    if not overwrite:
+        files = [ff for ff in files
+                 if not os.path.exists(get_output_name(ff, outdir))]
+
+    if nproc is None:
+        nproc = multiprocessing.cpu_count()
+
+    tasks = [(ff, outdir, pv_args, track_args, f0_args, cachedir, cachesize)
+             for ff in files]
+
+    results = []
+    pool = multiprocessing.Pool(nproc)
+    try:
+        for res in pool.imap_unordered(_analyse_task, tasks):
+            filename, outfile, dt, error = res
+            if error is None:
+                sys.stderr.write('{} ({:.2f} s)\n'.format(filename, dt))
+            else:
+                sys.stderr.write('{} FAILED ({:.2f} s): {}\n'.format(
+                                 filename, dt, error))
+            results.append(res)
+    finally:
+        pool.close()
+        pool.join()
+
+    sys.stderr.write('{} files analysed, {} failed\n'.format(
+        len(results), len([res for res in results if res[3] is not None])))
+    return results
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Phase vocoder analysis of many WAV files')
+    parser.add_argument('files', nargs='+', help='WAV files or patterns')
+    parser.add_argument('-o', '--outdir', default='.',
+                        help='directory for the results')
+    parser.add_argument('-j', '--nproc', type=int, default=None,
+                        help='number of processes')
+    parser.add_argument('--nfft', type=int, default=1024)
+    parser.add_argument('--hop', type=int, default=None)
+    parser.add_argument('--npks', type=int, default=20)
+    parser.add_argument('--pkthresh', type=float, default=0.005)
+    parser.add_argument('--maxpitchjmp', type=float, default=0.5)
+    parser.add_argument('--match', choices=['greedy', 'hungarian'],
+                        default='greedy', help='partial matching method')
+    parser.add_argument('--f0', action='store_true',
+                        help='also estimate f0 with PeriodSeries')
+    parser.add_argument('--fmin', type=float, default=50)
+    parser.add_argument('--fmax', type=float, default=5000)
+    parser.add_argument('--overwrite', action='store_true')
+    parser.add_argument('--cache', default=None, metavar='DIR',
+                        help='cache analysis results in DIR')
+    parser.add_argument('--cache-size', type=float, default=1024,
+                        help='maximum cache size in MB')
+    args = parser.parse_args(argv)
+
+    files = []
+    for pattern in args.files:
+        files.extend(sorted(glob.glob(pattern)))
+
+    pv_args = dict(nfft=args.nfft, hop=args.hop, npks=args.npks,
+                   pkthresh=args.pkthresh)
+    track_args = dict(maxpitchjmp=args.maxpitchjmp, match=args.match)
+    if args.f0:
+        f0_args = dict(fmin=args.fmin, fmax=args.fmax)
+    else:
+        f0_args = None
+
+    analyse_files(files, args.outdir, nproc=args.nproc, pv_args=pv_args,
+                  track_args=track_args, f0_args=f0_args,
+                  overwrite=args.overwrite, cachedir=args.cache,
+                  cachesize=int(args.cache_size*2**20))
+
+
+if __name__ == '__main__':
+    main()
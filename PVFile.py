@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  PVFile.py
+#
+#  Binary files for phase vocoder analysis results
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+"""
+Binary container for analysis results.
+
+A file starts with an 8 byte magic string and the length of a
+JSON header (8 bytes, little endian). The header holds the kind of
+contents, the analysis parameters and the type, shape and position
+of each array. Arrays follow, aligned to 64 bytes, and are read
+through memory maps, so that only the parts actually used are
+loaded from disk.
+"""
+
+import os
+import json
+import struct
+import numpy as np
+
+import PVAnalysis as pv
+import Periodicity as per
+
+MAGIC = b'PYPEVOC\x01'
+ALIGN = 64
+# version of the header and array layout
+VERSION = 1
+
+
+def _dtype_to_json(dtype):
+    if dtype.fields is None:
+        return dtype.str
+    return [[name, dtype.fields[name][0].str] for name in dtype.names]
+
+
+def _dtype_from_json(descr):
+    if isinstance(descr, list):
+        return np.dtype([(str(name), str(typ)) for name, typ in descr])
+    return np.dtype(str(descr))
+
+
+def write_arrays(filename, kind, params, arrays):
+    '''
+    Write a container file
+    Arguments:
+        * filename = file name
+        * kind     = string describing the contents
+        * params   = dictionary of parameters (JSON serialisable)
+        * arrays   = dictionary of numpy arrays
+    The file is written under a temporary name and renamed when
+    complete.
+    '''
+
+    # numpy scalars are stored as python numbers
+    params = dict((key, val.item() if isinstance(val, np.generic) else val)
+                  for key, val in params.items())
+
+    names = sorted(arrays.keys())
+    arrays = dict((name, np.ascontiguousarray(arrays[name]))
+                  for name in names)
+
+    descr = {}
+    relpos = {}
+    pos = 0
+    for name in names:
+        arr = arrays[name]
+        descr[name] = dict(dtype=_dtype_to_json(arr.dtype),
+                           shape=list(arr.shape))
+        relpos[name] = pos
+        pos += -(-arr.nbytes//ALIGN)*ALIGN
+
+    # arrays start after the header, whose length depends on the offsets
+    header = dict(kind=kind, version=VERSION, params=params, arrays=descr)
+    hdrsize = ALIGN
+    while True:
+        for name in names:
+            descr[name]['offset'] = hdrsize + relpos[name]
+        hdr = json.dumps(header).encode('utf-8')
+        needed = len(MAGIC) + 8 + len(hdr)
+        if needed <= hdrsize:
+            break
+        hdrsize = -(-needed//ALIGN)*ALIGN
+    hdr += b' '*(hdrsize - needed)
+
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(hdr)))
+        f.write(hdr)
+        for name in names:
+            f.seek(descr[name]['offset'])
+            arrays[name].tofile(f)
+        f.truncate(hdrsize + pos)
+    os.rename(tmpname, filename)
+
+
+class ArrayFile(object):
+    def __init__(self, filename, kind=None):
+        '''
+        Read a container file written by write_arrays
+        Arrays are memory-mapped when requested with get_array
+        Arguments:
+            * filename = file name
+            * kind     = expected kind of contents (not checked if None)
+        '''
+
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError('{} is not a PVFile container'.format(
+                                 filename))
+            hdrlen, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(hdrlen).decode('utf-8'))
+
+        if kind is not None and header['kind'] != kind:
+            raise ValueError('{} contains {}, not {}'.format(
+                             filename, header['kind'], kind))
+        self.kind = header['kind']
+        self.params = header['params']
+        self.descr = header['arrays']
+        self._arrays = {}
+
+    def get_array(self, name):
+        '''
+        Memory-mapped (read-only) array
+        '''
+
+        try:
+            return self._arrays[name]
+        except KeyError:
+            pass
+
+        descr = self.descr[name]
+        dtype = _dtype_from_json(descr['dtype'])
+        shape = tuple(descr['shape'])
+        if np.prod(shape) == 0:
+            arr = np.zeros(shape, dtype=dtype)
+        else:
+            arr = np.memmap(self.filename, dtype=dtype, mode='r',
+                            offset=descr['offset'], shape=shape)
+        self._arrays[name] = arr
+        return arr
+
+
+def save_pv(filename, mypv):
+    '''
+    Save the analysis results of a PVAnalysis.PV object
+    (after run_pv or one of its variants)
+    '''
+
+    if mypv.peaks is None:
+        raise ValueError('No peaks to save: run the analysis first')
+
+    params = dict(sr=mypv.sr, nfft=mypv.nfft, hop=mypv.hop,
+                  npeaks=mypv.npeaks, peakthresh=mypv.peakthresh,
+                  nframes=mypv.nframes)
+    arrays = dict(t=np.asarray(mypv.t, dtype=float),
+                  offsets=mypv.peaks.offsets.astype('<i8'),
+                  peaks=mypv.peaks.peaks,
+                  window=np.asarray(mypv.win, dtype=float))
+    write_arrays(filename, 'pv', params, arrays)
+
+
+class PVFile(ArrayFile):
+    def __init__(self, filename):
+        '''
+        Analysis results saved with save_pv
+        Frames are read from disk only when requested
+        '''
+
+        ArrayFile.__init__(self, filename, kind='pv')
+        for par in ['sr', 'nfft', 'hop', 'npeaks', 'peakthresh', 'nframes']:
+            setattr(self, par, self.params[par])
+
+    def __len__(self):
+        return self.nframes
+
+    def get_time(self, start=0, stop=None):
+        '''
+        Times of frames start to stop
+        '''
+        return self.get_array('t')[start:stop]
+
+    def get_window(self):
+        return np.array(self.get_array('window'))
+
+    def get_frames(self, start=0, stop=None):
+        '''
+        Peaks of frames start to stop (PVAnalysis.PeakFrames,
+        backed by the file)
+        '''
+
+        start, stop, step = slice(start, stop).indices(self.nframes)
+        stop = max(start, stop)
+        offsets = np.array(self.get_array('offsets')[start:stop+1])
+        peaks = self.get_array('peaks')[offsets[0]:offsets[-1]]
+        return pv.PeakFrames(peaks, offsets - offsets[0],
+                             npeaks=self.npeaks)
+
+    def get_dense(self, field, start=0, stop=None):
+        '''
+        Matrix (frames x npeaks) of a field for frames start to stop
+        '''
+        return self.get_frames(start, stop).dense(field)
+
+    def to_pv(self):
+        '''
+        PVAnalysis.PV object with the saved results
+        (without the analysed signal)
+        '''
+
+        mypv = pv.PV(np.zeros(0), self.sr, nfft=self.nfft, hop=self.hop,
+                     npks=self.npeaks, pkthresh=self.peakthresh,
+                     wind=self.get_window())
+        mypv.peaks = self.get_frames()
+        mypv.t = np.array(self.get_time())
+        mypv.nframes = self.nframes
+        return mypv
+
+
+def load_pv(filename):
+    '''
+    Load the analysis results saved with save_pv
+    Returns a PVAnalysis.PV object
+    '''
+    return PVFile(filename).to_pv()
+
+
+def save_sinsum(filename, ss):
+    '''
+    Save the partials of a PVAnalysis.SinSum object, with an index
+    of their start and end frames, mean frequency and mean magnitude
+    '''
+
+    store = ss.partial
+    npartials = len(store)
+    index = np.zeros(npartials, dtype=SinSumFile.index_dtype)
+    index['start'] = store.start
+    index['npts'] = store.npts
+    index['end'] = store.start + np.maximum(store.npts - 1, 0)
+    index['meanf'] = store.segment_mean('f')
+    index['meanmag'] = store.segment_mean('mag')
+
+    # partials by mean frequency (empty partials, with nan, at the end)
+    forder = np.argsort(index['meanf'], kind='mergesort')
+
+    params = dict(sr=ss.sr, nfft=ss.nfft, hop=ss.hop, npartials=npartials)
+    arrays = dict(index=index, forder=forder.astype('<i8'),
+                  sorted_f=index['meanf'][forder],
+                  offsets=store.get_offsets().astype('<i8'))
+    for field in ['f', 'mag', 'ph', 'realph']:
+        arrays[field] = store.get_column(field)
+    write_arrays(filename, 'sinsum', params, arrays)
+
+
+class SinSumFile(ArrayFile):
+    # index of partials
+    index_dtype = np.dtype([('start', '<i8'), ('end', '<i8'),
+                            ('npts', '<i8'), ('meanf', '<f8'),
+                            ('meanmag', '<f8')])
+
+    def __init__(self, filename):
+        '''
+        Partials saved with save_sinsum
+        Partials can be searched by time and frequency through the index,
+        and their values are read from disk only when requested
+        '''
+
+        ArrayFile.__init__(self, filename, kind='sinsum')
+        for par in ['sr', 'nfft', 'hop', 'npartials']:
+            setattr(self, par, self.params[par])
+
+    def __len__(self):
+        return self.npartials
+
+    def get_index(self):
+        '''
+        Start frame, end frame, number of points, mean frequency
+        and mean magnitude of each partial (structured array)
+        '''
+        return self.get_array('index')
+
+    def find_partials(self, fmin=None, fmax=None, tmin=None, tmax=None,
+                      minmag=None):
+        '''
+        Indices of the partials with mean frequency strictly between
+        fmin and fmax (as SinSum.get_part_data_around_freq), present at
+        some time between tmin and tmax (in seconds) and with mean
+        magnitude above minmag.
+        Limits that are None are not checked.
+        '''
+
+        # frequency range from the sorted mean frequencies
+        sorted_f = self.get_array('sorted_f')
+        if fmin is None:
+            ist = 0
+        else:
+            ist = np.searchsorted(sorted_f, fmin, side='right')
+        if fmax is None:
+            # skip empty partials (nan, at the end)
+            iend = np.searchsorted(sorted_f, np.inf, side='right')
+        else:
+            iend = np.searchsorted(sorted_f, fmax, side='left')
+        idx = np.sort(self.get_array('forder')[ist:iend])
+
+        index = self.get_index()[idx]
+        keep = index['npts'] > 0
+        if tmin is not None:
+            keep &= index['end'] >= tmin*self.sr/float(self.hop)
+        if tmax is not None:
+            keep &= index['start'] <= tmax*self.sr/float(self.hop)
+        if minmag is not None:
+            keep &= index['meanmag'] > minmag
+        return idx[keep]
+
+    def find_partials_around_freq(self, fc, semitones=.5, tmin=None,
+                                  tmax=None, minmag=None):
+        '''
+        Indices of the partials with mean frequency within a number of
+        semitones from fc (see find_partials)
+        '''
+        ratio = 2.**(semitones/12.)
+        return self.find_partials(fmin=fc/ratio, fmax=fc*ratio, tmin=tmin,
+                                  tmax=tmax, minmag=minmag)
+
+    def get_partial(self, pidx):
+        '''
+        Partial pidx as a PVAnalysis.RegPartial, with values
+        read from the file
+        '''
+
+        offsets = self.get_array('offsets')
+        ist, iend = offsets[pidx], offsets[pidx+1]
+        pdict = dict((field, self.get_array(field)[ist:iend])
+                     for field in ['f', 'mag', 'ph', 'realph'])
+        return pv.RegPartial(int(self.get_index()['start'][pidx]), pdict,
+                             overlap=self.hop/float(self.nfft),
+                             fstep=self.sr/float(self.nfft))
+
+    def get_part_data_around_freq(self, fc, semitones=.5, tmin=None,
+                                  tmax=None):
+        '''
+        Frequency, magnitude and phase of the partials around fc at
+        each frame (as SinSum.get_part_data_around_freq). Where partials
+        overlap, the one of highest mean magnitude is used.
+        If tmin or tmax are given, only frames between them are
+        returned.
+        Returns the time, frequency, magnitude and phase vectors
+        '''
+
+        index = self.get_index()
+        nframes = int(np.max(index['end'])) + 1 if len(index) else 0
+        frst = 0
+        frend = nframes
+        if tmin is not None:
+            frst = min(max(0, int(np.ceil(tmin*self.sr/float(self.hop)))),
+                       nframes)
+        if tmax is not None:
+            frend = max(min(nframes,
+                            int(np.floor(tmax*self.sr/float(self.hop))) + 1),
+                        frst)
+
+        t = np.arange(frst, frend)/float(self.sr)*self.hop
+        f = np.zeros(frend - frst)
+        mag = np.zeros(frend - frst)
+        ph = np.zeros(frend - frst)
+
+        idx = self.find_partials_around_freq(fc, semitones, tmin=tmin,
+                                             tmax=tmax)
+        idx = idx[np.argsort(index['meanmag'][idx], kind='mergesort')]
+
+        offsets = self.get_array('offsets')
+        allf = self.get_array('f')
+        allmag = self.get_array('mag')
+        allph = self.get_array('ph')
+        for i in idx:
+            sti = max(index['start'][i], frst)
+            endi = min(index['end'][i] + 1, frend)
+            pst = offsets[i] + sti - index['start'][i]
+            pend = pst + endi - sti
+            f[sti - frst:endi - frst] = allf[pst:pend]
+            mag[sti - frst:endi - frst] = allmag[pst:pend]
+            ph[sti - frst:endi - frst] = allph[pst:pend]
+
+        return t, f, mag, ph
+
+    def to_sinsum(self):
+        '''
+        PVAnalysis.SinSum object with all the saved partials
+        '''
+
+        index = self.get_index()
+        cols = [np.array(self.get_array(field))
+                for field in ['f', 'mag', 'ph', 'realph']]
+        store = pv.PartialStore.from_columns(index['start'], index['npts'],
+                                             *cols,
+                                             overlap=self.hop/float(self.nfft),
+                                             fstep=self.sr/float(self.nfft))
+        return pv.SinSum.from_partial_store(store, self.sr, nfft=self.nfft,
+                                            hop=self.hop)
+
+
+def load_sinsum(filename):
+    '''
+    Load the partials saved with save_sinsum
+    Returns a PVAnalysis.SinSum object
+    '''
+    return SinSumFile(filename).to_sinsum()
+
+
+def save_period_series(filename, ps):
+    '''
+    Save the periodicity candidates of a Periodicity.PeriodSeries
+    object (after calc)
+    '''
+
+    periods = ps.periods
+    ncand = np.array([len(pp.cand_period) for pp in periods], dtype='<i8')
+    offsets = np.concatenate(([0], np.cumsum(ncand))).astype('<i8')
+    # an unknown preferred candidate is stored as -1
+    preferred = np.array([pp.preferred if np.size(pp.preferred) else -1
+                          for pp in periods], dtype='<i8')
+
+    def _cat(field):
+        vals = [np.asarray(getattr(pp, field), dtype=float)
+                for pp in periods]
+        return np.concatenate(vals + [np.zeros(0)])
+
+    params = dict(sr=ps.sr, hop=ps.hop, method=ps.method,
+                  threshold=ps.threshold, vthresh=ps.vthresh,
+                  ncand=ps.ncand, cand_method=ps.cand_method,
+                  fftthresh=ps.fftthresh, mindelay=ps.mindelay,
+                  maxdelay=ps.maxdelay, nperiods=len(periods))
+    arrays = dict(index=np.array([pp.index for pp in periods], dtype=float),
+                  preferred=preferred, offsets=offsets,
+                  cand_period=_cat('cand_period'),
+                  cand_strength=_cat('cand_strength'),
+                  window=np.asarray(ps.wind, dtype=float))
+    write_arrays(filename, 'periodseries', params, arrays)
+
+
+class PeriodSeriesFile(ArrayFile):
+    def __init__(self, filename):
+        '''
+        Periodicity candidates saved with save_period_series
+        '''
+
+        ArrayFile.__init__(self, filename, kind='periodseries')
+        for par in ['sr', 'hop', 'method', 'threshold', 'vthresh', 'ncand',
+                    'cand_method', 'fftthresh', 'mindelay', 'maxdelay',
+                    'nperiods']:
+            setattr(self, par, self.params[par])
+        self.method = str(self.method)
+        self.cand_method = str(self.cand_method)
+
+    def __len__(self):
+        return self.nperiods
+
+    def get_periods(self, parent):
+        '''
+        List of Periodicity.Periodicity objects with the saved
+        candidates, attached to the PeriodSeries parent
+        '''
+
+        index = self.get_array('index')
+        preferred = self.get_array('preferred')
+        offsets = self.get_array('offsets')
+        cand_period = np.array(self.get_array('cand_period'))
+        cand_strength = np.array(self.get_array('cand_strength'))
+
+        periods = []
+        for ii in range(self.nperiods):
+            pp = per.Periodicity(parent, index[ii], calc=False)
+            pp.set_time_properties(index[ii])
+            pp.cand_period = cand_period[offsets[ii]:offsets[ii+1]]
+            pp.cand_strength = cand_strength[offsets[ii]:offsets[ii+1]]
+            if preferred[ii] < 0:
+                pp.preferred = []
+            else:
+                pp.preferred = int(preferred[ii])
+            periods.append(pp)
+        return periods
+
+    def to_period_series(self, x=None):
+        '''
+        Periodicity.PeriodSeries object with the saved results
+        Arguments:
+            * x = analysed signal (an empty signal if None)
+        '''
+
+        if x is None:
+            x = np.zeros(0)
+        ps = per.PeriodSeries(x, sr=self.sr,
+                              window=np.array(self.get_array('window')),
+                              hop=self.hop, threshold=self.threshold,
+                              vthresh=self.vthresh, fmin=None, fmax=None,
+                              ncand=self.ncand, method=self.method,
+                              cand_method=self.cand_method,
+                              fftthresh=self.fftthresh)
+        ps.mindelay = self.mindelay
+        ps.maxdelay = self.maxdelay
+        ps.periods = self.get_periods(ps)
+        return ps
+
+
+def load_period_series(filename, x=None):
+    '''
+    Load the periodicity candidates saved with save_period_series
+    Returns a Periodicity.PeriodSeries object
+    '''
+    return PeriodSeriesFile(filename).to_period_series(x)
@@ -30,6 +30,47 @@
 import numpy as np
 
 
+def _segment_argmin(x, starts):
+    """Position of the first minimum of each segment of x
+
+    Arguments:
+        x:      1-D array
+        starts: sorted starting positions of the segments
+                (each segment ends where the next one starts,
+                 the last one at the end of x)
+    """
+
+    segmin = np.minimum.reduceat(x, starts)
+    seglen = np.diff(np.append(starts, len(x)))
+    segmin = np.repeat(segmin, seglen)
+    # NaN is the minimum of a segment containing NaN, as in argmin
+    ismin = np.logical_or(x == segmin,
+                          np.logical_and(np.isnan(x), np.isnan(segmin)))
+    idx = np.where(ismin, np.arange(len(x)), len(x))
+    return np.minimum.reduceat(idx, starts)
+
+
+def _window_max(x, pos, rad):
+    """Maximum of x in windows of radius rad around positions pos
+    (along the last axis; the first point of x is excluded)
+
+    Arguments:
+        x:   1-D array, or 2-D array with one row per row of pos
+        pos: positions (same number of dimensions as x)
+        rad: radius of the window
+    """
+
+    if pos.size == 0:
+        # no peaks (or no rows)
+        return np.zeros(pos.shape, dtype=x.dtype)
+
+    npts = x.shape[-1]
+    win = np.clip(pos[..., np.newaxis] + np.arange(-rad, rad+1), 1, npts-1)
+    wval = np.take_along_axis(x, win.reshape(pos.shape[:-1] + (-1,)),
+                              axis=-1)
+    return np.max(wval.reshape(win.shape), axis=-1)
+
+
 class PeakFinder(object):
 
     def __init__(self, x, npeaks=None, minrattomax=None, minval=None):
@@ -75,20 +116,8 @@ class PeakFinder(object):
             is filtered out
         '''
 
-        npks = len(self.pos)
-        # keep = np.ones(npks).astype('bool')
-
-        for idx in range(npks):
-            thispos = self.pos[idx]
-            thisval = self.val[idx]
-            wmin = max(thispos-rad, 1)
-            wmax = min(thispos + rad, len(self.x))
-            w = self.x[wmin:wmax + 1]
-
-            if any(w > thisval):
-                self.keep[idx] = False
-
-        # self.keep = np.logical_and(self.keep, keep)
+        wmax = _window_max(self.x, self.pos, rad)
+        self.keep[wmax > self.val] = False
 
     def findpos(self):
         """Finds the peaks positions
@@ -105,27 +134,29 @@ class PeakFinder(object):
         pkmskamp = peakmask*(x[1:-1]-minx)
         # print(pkmskamp)
 
-        pos = []
-
-        m = pkmskamp.max()
-        b = pkmskamp.argmax()
         th = self.minamp-minx
-        n = 1
-
-        if m > th:
-            pos.append(b + 1)
-            pkmskamp[b] = th-1
-
-        while m > th and n < self.npeaks:
-            m = pkmskamp.max()
-            b = pkmskamp.argmax()
-            if m > th:
-                pos.append(b + 1)
-                pkmskamp[b] = th-1
-                n += 1
-
-        self.pos = np.array(pos)
-        self.val = np.array([x[i] for i in self.pos])
+
+        # all peaks above threshold
+        cand = np.flatnonzero(pkmskamp > th)
+        candamp = pkmskamp[cand]
+
+        if len(cand) > self.npeaks:
+            # keep the npeaks highest,
+            # lowest positions first among equal values
+            kthamp = -np.partition(-candamp, self.npeaks-1)[self.npeaks-1]
+            above = candamp > kthamp
+            equal = candamp == kthamp
+            nequal = self.npeaks - np.sum(above)
+            sel = np.logical_or(above, np.logical_and(equal, np.cumsum(equal)
+                                                      <= nequal))
+            cand = cand[sel]
+            candamp = candamp[sel]
+
+        # decreasing amplitude
+        idx = np.lexsort((cand, -candamp))
+
+        self.pos = cand[idx] + 1
+        self.val = x[self.pos]
         self.keep = np.ones(len(self.pos)).astype('bool')
 
     def plot(self, logarithmic=False):
@@ -187,32 +218,31 @@ class PeakFinder(object):
         Arguments:
             (none)
         """
-        try:
-            prevb = np.argmin(self.x[0:self.pos[0]])
-        except IndexError:
-            prevb = 0
-
-        bounds = []
-
         npks = len(self.pos)
+        if npks == 0:
+            self.bounds = np.array([])
+            return
+
+        firstpos = self.pos[0]
 
         if self.sorttype != 1:
             self.sort_pos()
 
-        for i in range(npks):
-            thismax = self.pos[i]
-            if i < npks-1:
-                nextmax = self.pos[i + 1]
-                relb = np.argmin(self.x[thismax:nextmax])
-                nextb = relb + thismax
-            else:
-                nextmax = len(self.x)-1
-                nextb = len(self.x)-1
+        # minima of segments between consecutive peaks,
+        # starting with one segment before the first peak
+        segmin = _segment_argmin(self.x, np.concatenate(([0], self.pos)))
 
-            bounds.append([prevb, nextb])
-            prevb = nextb
+        bounds = np.zeros((npks, 2), dtype=int)
+        bounds[:, 0] = segmin[:-1]
+        bounds[:, 1] = segmin[1:]
+        # last peak is bounded by the end of the array
+        bounds[-1, 1] = len(self.x)-1
+        if firstpos != self.pos[0]:
+            # first left bound is searched before the first peak
+            # found before sorting
+            bounds[0, 0] = np.argmin(self.x[0:firstpos])
 
-        self.bounds = np.array(bounds)
+        self.bounds = bounds
 
     def refine_opt(self, idx, xvec=None, rad=2):
         """use fit to quadratic to locate a fine maximum of
@@ -288,33 +318,93 @@ class PeakFinder(object):
         """use quadratic interpolation to refine all peaks
 
         Arguments:
-            idx: index of the peak to interpolate
+            logarithmic: interpolate the logarithm of the values
+            rad: number of points on each side of the peak used
+                 in the fit (rad > 1 uses a least-squares fit)
         """
 
         if logarithmic:
             x = np.log10(self.x)
+        else:
+            x = self.x
 
-        # rpos = self.pos
-        # rval = self.val
+        pos = np.asarray(self.pos, dtype=int)
         self.fpos = np.zeros(self.pos.shape)
         self.fval = np.zeros(self.pos.shape)
 
-        for i in range(len(self.pos)):
-            if logarithmic:
-                if rad > 1:
-                    fpos, fval = self.refine_opt(i, xvec=x, rad=rad)
-                else:
-                    fpos, fval = self.refine(i, xvec=x)
-            else:
-                if rad > 1:
-                    fpos, fval = self.refine_opt(i, rad=rad)
-                else:
-                    fpos, fval = self.refine(i)
-            self.fpos[i] = fpos
-            if logarithmic:
-                self.fval[i] = 10**fval
-            else:
-                self.fval[i] = fval
+        if rad > 1:
+            fpos, fval = self._refine_lsq(x, pos, rad)
+        else:
+            fpos, fval = self._refine_parabola(x, pos)
+
+        self.fpos[:] = fpos
+        if logarithmic:
+            self.fval[:] = 10**fval
+        else:
+            self.fval[:] = fval
+
+    def _refine_parabola(self, x, pos):
+        """3-point parabolic interpolation of all peaks
+        (same as refine for each peak)
+
+        Arguments:
+            x:   values
+            pos: peak positions
+        """
+
+        sur0 = x[pos-1]
+        sur1 = x[pos]
+        sur2 = x[pos+1]
+        ispk = np.logical_and(sur1 > sur0, sur1 >= sur2)
+
+        c = sur1
+        b = (sur2 - sur0)/2
+        a = (sur2 + sur0)/2 - c
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lpos = np.where(ispk, - b/2/a, 0)
+            fval = np.where(ispk, a*lpos*lpos + b*lpos + c, sur1)
+        return pos + lpos, fval
+
+    def _refine_lsq(self, x, pos, rad):
+        """least-squares quadratic fit on 2*rad+1 points around
+        all peaks (same as refine_opt for each peak)
+
+        Arguments:
+            x:   values
+            pos: peak positions
+            rad: radius of the fit window
+        """
+
+        fpos = np.zeros(len(pos))
+        fval = np.zeros(len(pos))
+
+        # peaks with a complete window: the fit coefficients are
+        # linear combinations of the window values
+        k = np.arange(-rad, rad+1)
+        full = np.logical_and(pos - rad >= 1, pos + rad + 1 <= len(x))
+        if np.any(full):
+            w = x[pos[full][:, np.newaxis] + k]
+            s0 = float(len(k))
+            s2 = float(np.sum(k**2))
+            s4 = float(np.sum(k**4))
+            det = s0*s4 - s2*s2
+            m0 = np.sum(w, axis=1)
+            m1 = np.dot(w, k)
+            m2 = np.dot(w, k**2)
+
+            a = (s0*m2 - s2*m0)/det
+            b = m1/s2
+            c = (s4*m0 - s2*m2)/det
+            lpos = - b/2.0/a
+            fpos[full] = pos[full] + lpos
+            fval[full] = a*lpos*lpos + b*lpos + c
+
+        # windows cut by the edges of x
+        for i in np.flatnonzero(np.logical_not(full)):
+            fpos[i], fval[i] = self.refine_opt(i, xvec=x, rad=rad)
+
+        return fpos, fval
 
     def get_pos(self, rough=False):
         """return a vector with peak position
@@ -373,3 +463,172 @@ class PeakFinder(object):
             rvec = np.array(zip(self.pos[self.keep], self.val[self.keep]))
 
         return rvec
+
+
+class PeakFinder2D(object):
+
+    def __init__(self, x, npeaks=None, minrattomax=None, minval=None):
+        """Finds peaks in each row of a 2-D array at once
+        (for instance each frame of a spectrogram)
+
+        Arguments:
+
+            x:           2-D array (rows x points)
+            npeaks:      maximum number of peaks to find in each row
+
+          Thresholds (as in PeakFinder, applied to each row):
+            minrattomax: ratio of minimum to maximum peak amplitude
+                         in the row (has priority over minval if set
+                         to other than None)
+            minval:      an absolute minimum value of peak
+                         (scalar or one value per row)
+
+        Peaks of each row are sorted by position. Results are stored
+        in arrays of rows x maximum number of peaks (pos, val, keep,
+        and bounds with an extra dimension for the left and right
+        boundaries). Entries beyond the peaks of a row are False in
+        self.valid
+        """
+
+        self.x = np.atleast_2d(np.asarray(x))
+        nrows = self.x.shape[0]
+
+        if minrattomax is None:
+            if minval is None:
+                minamp = np.zeros(nrows)
+            else:
+                minamp = np.ones(nrows)*minval
+        else:
+            minamp = self.x.max(axis=1)*minrattomax
+        # default threshold is the minimum of each row
+        self.minamp = np.where(minamp == 0, self.x.min(axis=1), minamp)
+
+        if not npeaks:
+            self.npeaks = self.x.shape[1]
+        else:
+            self.npeaks = npeaks
+
+        self.findpos()
+
+    def findpos(self):
+        """Finds the peaks positions in all rows
+
+        Arguments:
+            (none)
+        """
+
+        x = self.x
+        nrows = x.shape[0]
+
+        minx = np.min(x, axis=1)
+
+        peakmask = np.logical_and(x[:, 0:-2] < x[:, 1:-1],
+                                  x[:, 1:-1] >= x[:, 2:])
+        pkmskamp = peakmask*(x[:, 1:-1]-minx[:, np.newaxis])
+        th = (self.minamp-minx)[:, np.newaxis]
+
+        cand = pkmskamp > th
+
+        # rows with too many peaks keep the npeaks highest
+        over = np.sum(cand, axis=1) > self.npeaks
+        if np.any(over):
+            amp = np.where(cand[over], pkmskamp[over], -np.inf)
+            kthamp = -np.partition(-amp, self.npeaks-1,
+                                   axis=1)[:, self.npeaks-1:self.npeaks]
+            above = amp > kthamp
+            equal = amp == kthamp
+            nequal = self.npeaks - np.sum(above, axis=1)[:, np.newaxis]
+            cand[over] = np.logical_or(above, np.logical_and(
+                equal, np.cumsum(equal, axis=1) <= nequal))
+
+        self.npks = np.sum(cand, axis=1)
+        if nrows > 0:
+            maxpks = np.max(self.npks)
+        else:
+            maxpks = 0
+        self.valid = np.arange(maxpks) < self.npks[:, np.newaxis]
+
+        self.pos = np.zeros((nrows, maxpks), dtype=int)
+        self.pos[self.valid] = np.nonzero(cand)[1] + 1
+        self.val = np.where(self.valid,
+                            np.take_along_axis(x, self.pos, axis=1), 0)
+        self.keep = self.valid.copy()
+
+    def boundaries(self):
+        """Find the local minima on either side of each peak
+
+        Arguments:
+            (none)
+        """
+
+        nrows, npts = self.x.shape
+        maxpks = self.pos.shape[1]
+
+        # segments between consecutive peaks of each row,
+        # starting with one segment before the first peak
+        segst = np.zeros((nrows, maxpks + 1), dtype=int)
+        segst[:, 1:] = self.pos
+        segvalid = np.ones((nrows, maxpks + 1), dtype=bool)
+        segvalid[:, 1:] = self.valid
+        rowst = (np.arange(nrows)*npts)[:, np.newaxis]
+
+        segmin = np.zeros((nrows, maxpks + 1), dtype=int)
+        if nrows > 0:
+            segmin[segvalid] = _segment_argmin(
+                self.x.ravel(), (segst + rowst)[segvalid])
+            segmin -= rowst
+
+        bounds = np.zeros((nrows, maxpks, 2), dtype=int)
+        bounds[:, :, 0] = segmin[:, :-1]
+        bounds[:, :, 1] = segmin[:, 1:]
+        # last peak is bounded by the end of the row
+        haspks = np.flatnonzero(self.npks > 0)
+        bounds[haspks, self.npks[haspks]-1, 1] = npts-1
+        bounds[np.logical_not(self.valid)] = 0
+
+        self.bounds = bounds
+
+    def filter_by_salience(self, rad=1):
+        ''' Filters the peaks by salience.
+            Any peak that is lower than the neighbouring 'rad' points
+            is filtered out
+        '''
+
+        wmax = _window_max(self.x, self.pos, rad)
+        self.keep = np.logical_and(self.keep,
+                                   np.logical_not(wmax > self.val))
+
+    def pack(self, y):
+        """Gathers the values of y for the kept peaks at the start of
+        each row (padded with zeros)
+
+        Arguments:
+            y: array of the same shape as self.pos
+        """
+
+        npks = np.sum(self.keep, axis=1)
+        packed = np.zeros((len(npks), np.max(npks) if len(npks) else 0),
+                          dtype=np.asarray(y).dtype)
+        packed[np.arange(packed.shape[1]) < npks[:, np.newaxis]] = \
+            y[self.keep]
+        return packed
+
+    def get_count(self):
+        """return the number of kept peaks in each row
+        """
+
+        return np.sum(self.keep, axis=1)
+
+    def get_pos(self):
+        """return a matrix with the positions of kept peaks in
+        each row, padded with zeros (see get_count)
+        """
+
+        return self.pack(self.pos)
+
+    def get_val(self):
+        """return a matrix with the values of kept peaks in
+        each row, padded with zeros (see get_count)
+        """
+
+        return self.pack(self.val)
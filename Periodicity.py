@@ -32,17 +32,131 @@ import numpy as np
 import PeakFinder as pf
 import pylab as pl
 from matplotlib.colors import hsv_to_rgb
+from numpy.lib.stride_tricks import as_strided
+
+try:
+    from scipy.fftpack import next_fast_len
+except ImportError:
+    def next_fast_len(target):
+        """Smallest 5-smooth number (2**a * 3**b * 5**c) not smaller
+           than target, a fast length for the FFT
+        """
+        best = 2**int(np.ceil(np.log2(max(target, 1))))
+        p5 = 1
+        while p5 < best:
+            p35 = p5
+            while p35 < best:
+                # smallest power of two bringing p35 up to target
+                nn = p35
+                while nn < target:
+                    nn *= 2
+                best = min(best, nn)
+                p35 *= 3
+            p5 *= 5
+        return best
+
+
+def autocorr(x, maxlag=None, nfft=None):
+    """Autocorrelation of x for lags 0 to maxlag, calculated with
+       the FFT (same as the positive lags of np.correlate(x, x, "full"))
+
+    Arguments:
+    x:      signal
+    maxlag: maximum lag (default len(x)-1)
+    nfft:   length of the zero-padded FFT (default: the next fast
+            length not smaller than len(x)+maxlag, which avoids
+            circular wrapping of the returned lags)
+    """
+
+    nx = len(x)
+    if maxlag is None:
+        maxlag = nx - 1
+    if nfft is None:
+        nfft = next_fast_len(nx + maxlag)
+    xf = np.fft.rfft(x, nfft)
+    return np.fft.irfft(xf.real**2 + xf.imag**2, nfft)[:maxlag+1]
+
+
+def amdf(x, mindelay=0, maxdelay=None, blocksize=32):
+    """Average magnitude difference function of x for lags
+       mindelay to maxdelay-1 (other lags are left at zero)
+
+    The lags are calculated in blocks of blocksize, each one as
+    a single 2-D array operation
+
+    Arguments:
+    x:         signal
+    mindelay:  first lag
+    maxdelay:  last lag + 1 (default len(x))
+    blocksize: number of lags calculated at once
+    """
+
+    x = np.asarray(x, dtype=float)
+    nx = len(x)
+    if maxdelay is None:
+        maxdelay = nx
+    maxdelay = min(maxdelay, nx)
+
+    y = np.zeros(nx)
+    if maxdelay <= mindelay:
+        return y
+
+    # zero padding, so that all lags in a block can be read with
+    # the same length as the first one
+    xp = np.concatenate((x, np.zeros(blocksize)))
+    step = xp.strides[0]
+    buf = np.empty(blocksize*(nx - mindelay))
+    for st in range(mindelay, maxdelay, blocksize):
+        lags = np.arange(st, min(st + blocksize, maxdelay))
+        n = nx - lags
+        m = n[0]
+        shifted = as_strided(xp[st:], shape=(len(lags), m),
+                             strides=(step, step))
+        diff = buf[:len(lags)*m].reshape((len(lags), m))
+        np.subtract(x[:m], shifted, out=diff)
+        np.abs(diff, out=diff)
+        # differences with the padding are discarded
+        tail = n[-1]
+        pad = np.arange(tail, m)[np.newaxis, :] >= n[:, np.newaxis]
+        diff[:, tail:][pad] = 0.
+        y[lags] = diff.sum(axis=1)/n
 
+    return y
+
+
+def asdf(x, mindelay=0, maxdelay=None):
+    """Average squared difference function of x for lags
+       mindelay to maxdelay-1 (other lags are left at zero)
 
-def amdf(x, mindelay=0, maxdelay=None):
+    This is the difference function of the YIN estimator, divided
+    by the number of differences at each lag. It is calculated from
+    the FFT autocorrelation and the cumulative energy of x:
+
+        sum (x[j]-x[j+k])**2 = sum x[j]**2 + sum x[j+k]**2 - 2 r[k]
+
+    Arguments:
+    x:        signal
+    mindelay: first lag
+    maxdelay: last lag + 1 (default len(x))
+    """
+
+    x = np.asarray(x, dtype=float)
     nx = len(x)
     if maxdelay is None:
         maxdelay = nx
+    maxdelay = min(maxdelay, nx)
 
     y = np.zeros(nx)
-    for i in range(mindelay, maxdelay):
-        n = nx - i
-        y[i] = (np.abs(x[0:nx-i]-x[i:])).sum()/n
+    if maxdelay <= mindelay:
+        return y
+
+    lags = np.arange(mindelay, maxdelay)
+    n = nx - lags
+    r = autocorr(x, maxlag=maxdelay-1)
+    energy = np.concatenate(([0.], np.cumsum(x**2)))
+    d = energy[n] + (energy[nx] - energy[lags]) - 2*r[lags]
+    # rounding errors can give small negative values
+    y[lags] = np.maximum(d, 0.)/n
 
     return y
 
@@ -54,18 +168,22 @@ def amdf(x, mindelay=0, maxdelay=None):
 class Periodicity(object):
     """Single period object, including multiple periodicity candidates
     """
-    def __init__(self, parent, index=0):
+    def __init__(self, parent, index=0, calc=True):
         """Calculate the periodicity estimation for a window
            of a time signal
 
         Arguments:
         parent: parent object contaigning entire signal
         idx:    index of local peridoicity calulation
+        calc:   calculate the candidates (otherwise they are
+                left empty, to be filled with stored results)
         """
 
         self.parent = parent
         self.nwind = parent.nwind
         self.wnorm = parent.wnorm
+        self.nwnorm = parent.nwnorm
+        self.ncorr = parent.ncorr
         self.wind = parent.wind
         self.sr = parent.sr
 
@@ -91,7 +209,8 @@ class Periodicity(object):
         self.cand_method = parent.cand_method
         self.index=index
 
-        self._calc()
+        if calc:
+            self._calc()
 
     def _calc(self):
         """Calculate the periodicity candidates
@@ -109,8 +228,6 @@ class Periodicity(object):
         xs = self.parent.x[ist:iend]
         xw = (xs-np.mean(xs)) * self.wind
 
-        nwind = self.nwind
-
         # unvoiced
         pkpos = np.array([])
         pkstr = np.array([])
@@ -118,27 +235,49 @@ class Periodicity(object):
         peaks = None
 
         try:
-            if self.method is 'amdf':
-                xc = amdf(xw)
+            if self.method in ('amdf', 'asdf'):
+                # the candidates are normalised by the maximum over
+                # the longest lags of the window, as in the original
+                # implementation over all lags
+                nwind = self.nwind
+                refslice = slice(nwind-1-self.maxdelay,
+                                 nwind-1+self.maxdelay)
+                refst, refend, step = refslice.indices(nwind)
+                computed = np.zeros(nwind, dtype=bool)
+                computed[self.mindelay:self.maxdelay] = True
+                computed[refst:refend] = True
+                if self.method == 'amdf':
+                    # long lags have few differences, so adding
+                    # them costs little
+                    xc = amdf(xw, self.mindelay, self.maxdelay)
+                    xc[refst:refend] = amdf(xw, refst, refend)[refst:refend]
+                else:
+                    xc = asdf(xw, min(self.mindelay, refst),
+                              max(self.maxdelay, refend))
 
-                maxxc = max(xc[nwind-1-self.maxdelay:nwind-1+self.maxdelay])
+                maxxc = max(xc[refst:refend])
                 xcn = (maxxc-xc)/maxxc
+                xcn[np.logical_not(computed)] = np.nan
                 imin = self.mindelay
                 xcpos = xcn[imin:self.maxdelay]
                 xcth = self.threshold
 
-            elif self.method is 'xcorr':
+            elif self.method == 'xcorr':
 
-                xc = np.correlate(xw, xw, "full") / self.wnorm
+                # positive lags only, the autocorrelation is symmetric
+                xc = autocorr(xw, nfft=self.ncorr)
 
-                negvals = np.flatnonzero(xc[nwind-1:] < 0)
+                # the first negative value is searched over all lags
+                # where the window normalisation is defined
+                negvals = np.flatnonzero(xc[:self.nwnorm] < 0)
                 if len(negvals) > 0:
-                    firstneg = np.min(negvals)
+                    firstneg = negvals[0]
                 else:
                     firstneg = self.mindelay
                 imin = max(firstneg, self.mindelay)
-                xcn = xc/max(xc[nwind-1-self.maxdelay:nwind-1+self.maxdelay])
-                xcpos = xcn[nwind-1+imin:nwind-1+self.maxdelay]
+                xc = xc[:self.maxdelay+1] / self.wnorm[:self.maxdelay+1]
+                xcn = xc/max(xc)
+                xcpos = xcn[imin:self.maxdelay]
 
                 xcth = self.threshold
 
@@ -204,7 +343,7 @@ class Periodicity(object):
 
         if not ax:
             fig, ax = pl.subplots(1)
-        ln = ax.plot(np.arange(len(xc))-self.nwind+1, xc)
+        ln = ax.plot(np.arange(len(xc)), xc)
         ax.hold('on')
         ax.plot(self.cand_period, self.cand_strength, 'o',
                 color=ln[0].get_color())
@@ -256,7 +395,7 @@ class PeriodSeries(object):
         """Calculate the average mean difference of x around index
 
         Arguments:
-        x:         signal
+        x:         signal (numpy array or SoundUtils.MappedSignal)
         sr:        sample rate
         window:    window around index used for difference calculations
         threshold: ratio to lowest minima to keep as peak
@@ -267,6 +406,7 @@ class PeriodSeries(object):
         method:    type of correlation correlation / matching to use
                    'xcorr' - correlation
                    'amdf'  - average mean difference function
+                   'asdf'  - average squared difference function
                    'zc'    - zero crossing
         cand_method: method for candidate selection:
                      'fft'    - based on an fft of the window
@@ -329,15 +469,24 @@ class PeriodSeries(object):
 
     def _calc_window_norm(self):
         """Calculate the normalisation function for window
+           (autocorrelation of the window for positive lags)
 
         Arguments: (None)
         """
 
-        if self.method is 'xcorr':
-            w = self.wind
-            self.wnorm = np.correlate(w, w, "full")
+        w = np.asarray(self.wind, dtype=float)
+        nw = len(w)
+        # FFT length for the autocorrelation of a window of signal
+        self.ncorr = next_fast_len(2*nw - 1)
+        if self.method == 'xcorr':
+            self.wnorm = autocorr(w, nfft=self.ncorr)
+            # lags where the window overlap is not (numerically) zero,
+            # the normalised correlation is undefined beyond them
+            valid = np.flatnonzero(self.wnorm > self.wnorm[0]*1e-10)
+            self.nwnorm = valid[-1] + 1
         else:
             self.wnorm = 1.
+            self.nwnorm = nw
 
     def per_at_index(self, index):
         """Calculate the average mean difference of x around index
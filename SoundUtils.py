@@ -2,6 +2,83 @@ import numpy as np
 import sys
 
 
+class MappedSignal(object):
+    '''
+    Read-only signal backed by a (memory-mapped) array of PCM samples.
+
+    Slicing returns floating point samples, converted only for the
+    requested range. Integer samples are scaled to the range -1 to 1.
+    Can be used in place of a numpy array as input for
+    PVAnalysis.PV and Periodicity.PeriodSeries
+    '''
+    def __init__(self, data, channel=0):
+        '''
+        Arguments:
+            * data:    array of samples (samples x channels)
+            * channel: channel to use for multi-channel data
+        '''
+        if data.ndim > 1:
+            data = data[:, channel]
+        self.data = data
+        self.dtype = np.dtype(float)
+
+        if data.dtype.kind == 'u':
+            # unsigned samples (8-bit WAV) are centred on half-range
+            self.offset = 2.0**(8*data.dtype.itemsize - 1)
+            self.scale = 1./self.offset
+        elif data.dtype.kind == 'i':
+            self.offset = 0.0
+            self.scale = 1./np.iinfo(data.dtype).max
+        else:
+            self.offset = 0.0
+            self.scale = 1.0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        x = self.data[idx].astype(float)
+        if self.offset:
+            x -= self.offset
+        if self.scale != 1.0:
+            x *= self.scale
+        return x
+
+    def astype(self, dtype):
+        '''
+        Signals are always converted to float when read,
+        so the object stands for itself
+        '''
+        return self
+
+
+def WavMemmap(filename, channel=0):
+    '''
+    Open a WAV file as a memory-mapped signal
+    Returns the sampling rate and a MappedSignal object
+
+    Only PCM files supported by scipy.io.wavfile can be mapped
+    '''
+    from scipy.io import wavfile
+
+    sr, data = wavfile.read(filename, mmap=True)
+    return sr, MappedSignal(data, channel=channel)
+
+
+def RawMemmap(filename, dtype='int16', nchannels=1, channel=0, offset=0):
+    '''
+    Open a headerless PCM file as a memory-mapped signal
+    * dtype:     sample format (numpy dtype, e.g. '<i2' for 16-bit LE)
+    * nchannels: number of interleaved channels
+    * channel:   channel to read
+    * offset:    number of bytes to skip at start of file
+    '''
+    data = np.memmap(filename, dtype=dtype, mode='r', offset=offset)
+    nsamp = len(data)//nchannels
+    data = data[:nsamp*nchannels].reshape((nsamp, nchannels))
+    return MappedSignal(data, channel=channel)
+
+
 def FftFilter(x, bands, gains):
     '''
     Filter signal x using FFT and IFFT
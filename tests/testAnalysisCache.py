@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+import numpy as np
+
+import AnalysisCache as ac
+
+
+class testAnalysisCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ac.AnalysisCache(os.path.join(self.tmpdir, 'cache'))
+        self.sr = 8000
+        t = np.arange(self.sr/2)/float(self.sr)
+        self.x = .1*np.sin(2*np.pi*400*t) + .05*np.sin(2*np.pi*1200*t)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_pv(self, x, **kwargs):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return self.cache.pv(x, self.sr, **kwargs)
+
+    def test_key(self):
+        k1 = self.cache.get_key('pv', self.x, dict(nfft=1024))
+        self.assertEqual(k1, self.cache.get_key('pv', self.x.copy(),
+                                                dict(nfft=1024)))
+        self.assertNotEqual(k1, self.cache.get_key('pv', self.x,
+                                                   dict(nfft=512)))
+        self.assertNotEqual(k1, self.cache.get_key('pv', self.x[:-1],
+                                                   dict(nfft=1024)))
+        w1 = self.cache.get_key('pv', self.x, dict(window=np.hanning(16)))
+        w2 = self.cache.get_key('pv', self.x, dict(window=np.hamming(16)))
+        self.assertNotEqual(w1, w2)
+
+    def test_pv(self):
+        p1 = self.get_pv(self.x, nfft=512, hop=128)
+        self.assertEqual(self.cache.misses, 1)
+        p2 = self.get_pv(self.x, nfft=512, hop=128)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(p2.nframes, p1.nframes)
+        for field in ['t', 'f', 'mag', 'ph']:
+            np.testing.assert_array_equal(getattr(p2, field),
+                                          getattr(p1, field))
+
+        # different parameters are analysed again
+        self.get_pv(self.x, nfft=512, hop=256)
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_period_series(self):
+        args = dict(fmin=100, fmax=1000)
+        p1 = self.cache.period_series(self.x, self.sr, **args)
+        p2 = self.cache.period_series(self.x, self.sr, **args)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(len(p2.periods), len(p1.periods))
+        np.testing.assert_array_equal(p2.get_times(), p1.get_times())
+        np.testing.assert_array_equal(p2.get_f0(), p1.get_f0())
+        np.testing.assert_array_equal(p2.get_strength(), p1.get_strength())
+        for per1, per2 in zip(p1.periods, p2.periods):
+            np.testing.assert_array_equal(per2.cand_period, per1.cand_period)
+
+    def test_eviction(self):
+        self.get_pv(self.x, nfft=512)
+        size = self.cache.get_size()
+        keys = [name for name in os.listdir(self.cache.cachedir)
+                if name.endswith(ac.SUFFIX)]
+        self.assertEqual(len(keys), 1)
+        # make the first result older
+        old = os.path.join(self.cache.cachedir, keys[0])
+        os.utime(old, (1e9, 1e9))
+
+        self.cache.maxsize = int(1.5*size)
+        self.get_pv(self.x*.5, nfft=512)
+        self.assertFalse(os.path.exists(old))
+        self.assertLessEqual(self.cache.get_size(), self.cache.maxsize)
+
+    def test_hit_refreshes(self):
+        self.get_pv(self.x, nfft=512)
+        name = os.listdir(self.cache.cachedir)
+        filename = [os.path.join(self.cache.cachedir, nn) for nn in name
+                    if nn.endswith(ac.SUFFIX)][0]
+        os.utime(filename, (1e9, 1e9))
+        self.get_pv(self.x, nfft=512)
+        self.assertGreater(os.path.getmtime(filename), 1e9)
+
+    def evict_after_lookup(self):
+        # another process removes the entry as soon as lookup returns
+        lookup = self.cache.lookup
+
+        def lookup_and_evict(key, opener):
+            res = lookup(key, opener)
+            os.remove(self.cache.get_filename(key))
+            return res
+        self.cache.lookup = lookup_and_evict
+
+    def test_evicted_after_hit_pv(self):
+        p1 = self.get_pv(self.x, nfft=512)
+        self.evict_after_lookup()
+        p2 = self.get_pv(self.x, nfft=512)
+        self.assertEqual(self.cache.hits, 1)
+        for field in ['t', 'f', 'mag', 'ph']:
+            np.testing.assert_array_equal(getattr(p2, field),
+                                          getattr(p1, field))
+
+    def test_evicted_after_hit_period_series(self):
+        args = dict(fmin=100, fmax=1000)
+        p1 = self.cache.period_series(self.x, self.sr, **args)
+        self.evict_after_lookup()
+        p2 = self.cache.period_series(self.x, self.sr, **args)
+        self.assertEqual(self.cache.hits, 1)
+        np.testing.assert_array_equal(p2.get_f0(), p1.get_f0())
+
+    def test_version_in_key(self):
+        k1 = self.cache.get_key('pv', self.x, dict(nfft=1024))
+        version = ac.CACHE_VERSION
+        try:
+            ac.CACHE_VERSION = version + 1
+            k2 = self.cache.get_key('pv', self.x, dict(nfft=1024))
+        finally:
+            ac.CACHE_VERSION = version
+        self.assertNotEqual(k1, k2)
+
+    def test_corrupt_file(self):
+        self.get_pv(self.x, nfft=512)
+        for name in os.listdir(self.cache.cachedir):
+            if name.endswith(ac.SUFFIX):
+                with open(os.path.join(self.cache.cachedir, name), 'wb') as f:
+                    f.write(b'garbage')
+        self.get_pv(self.x, nfft=512)
+        self.assertEqual(self.cache.misses, 2)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from scipy.io import wavfile
+
+import BatchAnalysis as ba
+
+
+class testBatchAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        sr = 44100
+        t = np.arange(sr/4)/float(sr)
+        for ii, f0 in enumerate([300., 500.]):
+            x = (.3*np.sin(2*np.pi*f0*t)*32767).astype('int16')
+            wavfile.write(os.path.join(self.tmpdir, 'snd%d.wav' % ii), sr, x)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_analyse_glob(self):
+        outdir = os.path.join(self.tmpdir, 'out')
+        res = ba.analyse_files(os.path.join(self.tmpdir, '*.wav'), outdir,
+                               nproc=2, f0_args=dict(fmin=100, fmax=1000))
+        self.assertEqual(len(res), 2)
+        for filename, outfile, dt, error in res:
+            self.assertIsNone(error)
+            data = np.load(outfile)
+            self.assertEqual(len(data['offsets']), len(data['t']) + 1)
+            self.assertEqual(data['offsets'][-1], len(data['peaks']))
+            self.assertLessEqual(np.max(np.diff(data['offsets'])), 20)
+            self.assertEqual(sum(data['part_len']), len(data['part_f']))
+            self.assertIn('f0', data.files)
+
+        # files with results are skipped
+        res = ba.analyse_files(os.path.join(self.tmpdir, '*.wav'), outdir)
+        self.assertEqual(len(res), 0)
+
+    def test_same_name_in_different_dirs(self):
+        sr = 44100
+        t = np.arange(sr/4)/float(sr)
+        files = []
+        for ii, f0 in enumerate([300., 500.]):
+            subdir = os.path.join(self.tmpdir, 'take%d' % ii)
+            os.makedirs(subdir)
+            filename = os.path.join(subdir, 'snd.wav')
+            x = (.3*np.sin(2*np.pi*f0*t)*32767).astype('int16')
+            wavfile.write(filename, sr, x)
+            files.append(filename)
+        self.assertNotEqual(ba.get_output_name(files[0], self.tmpdir),
+                            ba.get_output_name(files[1], self.tmpdir))
+
+        outdir = os.path.join(self.tmpdir, 'out')
+        res = ba.analyse_files(files, outdir, nproc=2)
+        self.assertEqual(len(res), 2)
+        self.assertEqual(len(set(outfile for ff, outfile, dt, err in res)),
+                         2)
+
+    def test_unicode_pattern(self):
+        outdir = os.path.join(self.tmpdir, 'out')
+        pattern = u'' + os.path.join(self.tmpdir, '*.wav')
+        res = ba.analyse_files(pattern, outdir, nproc=1)
+        self.assertEqual(len(res), 2)
+
+    def test_cache(self):
+        outdir = os.path.join(self.tmpdir, 'out')
+        cachedir = os.path.join(self.tmpdir, 'cache')
+        f0_args = dict(fmin=100, fmax=1000)
+        res = ba.analyse_files(os.path.join(self.tmpdir, '*.wav'), outdir,
+                               nproc=2, f0_args=f0_args, cachedir=cachedir)
+        first = dict((ff, np.load(out)['f0']) for ff, out, dt, err in res)
+        # one PV and one f0 result per file
+        cached = [name for name in os.listdir(cachedir)
+                  if name.endswith('.pvf')]
+        self.assertEqual(len(cached), 4)
+
+        res = ba.analyse_files(os.path.join(self.tmpdir, '*.wav'), outdir,
+                               nproc=2, f0_args=f0_args, cachedir=cachedir,
+                               overwrite=True)
+        for filename, outfile, dt, error in res:
+            self.assertIsNone(error)
+            np.testing.assert_array_equal(np.load(outfile)['f0'],
+                                          first[filename])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
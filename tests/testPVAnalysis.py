@@ -0,0 +1,511 @@
+import os
+import multiprocessing
+import tempfile
+import unittest
+import warnings
+import numpy as np
+from scipy.io import wavfile
+
+import PVAnalysis as pv
+import SoundUtils as su
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'examples')
+
+
+def gen_harmonic(f0=400., sr=44100, nsamp=44100, amps=[.1, .05]):
+    t = np.arange(nsamp)/float(sr)
+    x = np.zeros(nsamp)
+    for hno, amp in enumerate(amps):
+        x += amp*np.sin(2.*np.pi*f0*(hno+1)*t)
+    return x
+
+
+def run_pv_quiet(mypv, method='run_pv', **kwargs):
+    # first frame divides by an empty previous spectrum
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        getattr(mypv, method)(**kwargs)
+    return mypv
+
+
+def partial_synth_loop(part, sr, hop, edge=.5):
+    # frame by frame resynthesis of a RegPartial
+    nfr = len(part.f)
+    dfr = 1./part.overlap/2.
+    sig = np.zeros(hop*(nfr))
+    newt = np.arange(hop*(nfr + dfr))
+    fsig = np.interp(newt, hop*(dfr + .5 + np.arange(nfr)), part.f)
+    msig = np.interp(newt, hop*(dfr + np.arange(nfr)), part.mag)
+    for ii in xrange(nfr):
+        fsam = fsig[hop*ii:(hop*(ii+1) - 1)]
+        ph = pv.pi2 * np.cumsum(fsam/float(sr))
+        ph = np.insert(ph, 0, 0)
+        phcor = np.pi*(fsig[hop*(ii+1)] - fsig[hop*ii])/part.fstep/2.
+        if ii < nfr-1:
+            phcornext = np.pi*(fsig[hop*(ii+2)] -
+                               fsig[hop*(ii+1)])/part.fstep/2.
+        ph += part.realph[ii] + phcor
+        if ii < nfr-1:
+            phend = ph[-1] + pv.pi2*fsig[hop*(ii+1)]/float(sr)
+            dph = np.mod(part.realph[ii+1] + phcornext - phend+np.pi,
+                         pv.pi2) - np.pi
+            ph += np.linspace(0.0, dph, num=hop+1)[:-1]
+        sig[hop*ii:hop*(ii+1)] = msig[hop*ii:hop*(ii+1)] * np.cos(ph)
+    edgsam = int(dfr*hop*edge)
+    mag = msig[0]*(1 - np.cos(np.pi*np.arange(edgsam)/float(edgsam)))/2.
+    phb = np.flipud(part.realph[0] -
+                    pv.pi2*np.cumsum(part.f[0]*np.ones(edgsam)/float(sr)))
+    sig = np.insert(sig, 0, mag*np.cos(phb))
+    mag = msig[hop*(ii+1)]*(1+np.cos(np.pi*np.arange(edgsam)
+                                     / float(edgsam)))/2.
+    phb = ph[-1] + pv.pi2*np.cumsum(part.f[-1]*np.ones(edgsam)/float(sr))
+    sig = np.append(sig, mag*np.cos(phb))
+    return sig, int((part.start_idx)*hop - edgsam)
+
+
+class testDphase2Freq(unittest.TestCase):
+    def test_array_same_as_scalar(self):
+        mypv = pv.PV(np.zeros(4096), 44100, nfft=1024, hop=256)
+        np.random.seed(1)
+        nbin = np.random.randint(0, 512, size=(6, 4))
+        dph = np.random.uniform(-np.pi, np.pi, size=nbin.shape)
+        f, df = mypv.dphase2freq_array(dph, nbin)
+        self.assertEqual(f.shape, nbin.shape)
+        for ii, jj in np.ndindex(*nbin.shape):
+            fs, dfs = mypv.dphase2freq(dph[ii, jj], nbin[ii, jj])
+            self.assertEqual(f[ii, jj], fs)
+            self.assertEqual(df[ii, jj], dfs)
+
+
+class testPVBatch(unittest.TestCase):
+    def test_batch_same_as_serial(self):
+        sr = 44100
+        x = gen_harmonic(sr=sr, nsamp=sr/2)
+        p1 = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        p2 = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256),
+                          'run_pv_batch', blocksize=7)
+        self.assertEqual(p1.nframes, p2.nframes)
+        np.testing.assert_array_equal(p1.t, p2.t)
+        np.testing.assert_array_equal(p1.binno, p2.binno)
+        np.testing.assert_allclose(p1.f, p2.f, rtol=1e-9)
+        np.testing.assert_allclose(p1.mag, p2.mag, rtol=1e-9)
+
+    def test_parallel_same_as_serial(self):
+        sr = 44100
+        x = gen_harmonic(sr=sr, nsamp=sr/2)
+        p1 = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        p2 = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256),
+                          'run_pv_parallel', nproc=2, nchunks=5)
+        for attr in ['t', 'f', 'mag', 'ph', 'realph', 'binno']:
+            np.testing.assert_array_equal(getattr(p1, attr),
+                                          getattr(p2, attr))
+
+    def test_parallel_given_pool(self):
+        sr = 44100
+        x = gen_harmonic(sr=sr, nsamp=sr/2)
+        p1 = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        pool = multiprocessing.Pool(2)
+        try:
+            p2 = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256),
+                              'run_pv_parallel', pool=pool)
+        finally:
+            pool.close()
+            pool.join()
+        # one process: serial analysis
+        p3 = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256),
+                          'run_pv_parallel', nproc=1)
+        for attr in ['t', 'f', 'mag', 'ph', 'realph', 'binno']:
+            np.testing.assert_array_equal(getattr(p1, attr),
+                                          getattr(p2, attr))
+            np.testing.assert_array_equal(getattr(p1, attr),
+                                          getattr(p3, attr))
+
+
+class testPVStream(unittest.TestCase):
+    def test_stream_same_as_run_pv(self):
+        sr = 44100
+        x = gen_harmonic(sr=sr, nsamp=sr/4)
+        p1 = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        stream = pv.PVStream(sr, nfft=1024, hop=256)
+        frames = []
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for ist in range(0, len(x), 1000):
+                frames.extend(stream.push(x[ist:ist+1000]))
+        self.assertLessEqual(len(stream.x), 1024)
+        self.assertGreaterEqual(len(frames), p1.nframes)
+        for fr in range(p1.nframes):
+            t, f, mag, ph, realph, binno = frames[fr]
+            self.assertAlmostEqual(t, p1.t[fr])
+            np.testing.assert_array_equal(f, p1.f[fr, :len(f)])
+            np.testing.assert_array_equal(mag, p1.mag[fr, :len(mag)])
+            np.testing.assert_array_equal(binno, p1.binno[fr, :len(f)])
+
+    def test_push_result_not_consumed(self):
+        sr = 44100
+        x = gen_harmonic(sr=sr, nsamp=sr/4)
+        stream = pv.PVStream(sr, nfft=1024, hop=256)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for ist in range(0, len(x), 1000):
+                stream.push(x[ist:ist+1000])
+                self.assertLess(len(stream.x), 1024)
+        self.assertEqual(stream.nframes, (len(x)-1024)//256 + 1)
+
+
+class testPVMappedInput(unittest.TestCase):
+    def test_wav_memmap_same_as_array(self):
+        sr = 44100
+        x = (gen_harmonic(sr=sr, nsamp=sr/4)*32767).astype('int16')
+        fd, filename = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            wavfile.write(filename, sr, x)
+            srm, xm = su.WavMemmap(filename)
+            self.assertEqual(srm, sr)
+            self.assertEqual(len(xm), len(x))
+            p1 = run_pv_quiet(pv.PV(x/32767., sr, nfft=1024, hop=256))
+            p2 = run_pv_quiet(pv.PV(xm, sr, nfft=1024, hop=256))
+            self.assertIs(p2.x, xm)
+            np.testing.assert_allclose(p1.f, p2.f)
+            np.testing.assert_allclose(p1.mag, p2.mag)
+            del xm, p2
+        finally:
+            os.remove(filename)
+
+
+class testSinSumIndex(unittest.TestCase):
+    def test_partial_lookup(self):
+        sr = 44100
+        np.random.seed(5)
+        x = gen_harmonic(sr=sr, nsamp=sr/4) + .01*np.random.randn(sr/4)
+        mypv = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        ss = mypv.toSinSum()
+        st = np.array(ss.st)
+        end = np.array(ss.end)
+        for fr in range(mypv.nframes):
+            np.testing.assert_array_equal(
+                ss.get_partials_idx_at_frame(fr),
+                np.flatnonzero(np.logical_and(st <= fr, end >= fr)))
+            np.testing.assert_array_equal(
+                ss.get_partials_idx_ending_at_frame(fr),
+                np.flatnonzero(end == fr))
+
+    def test_points_in_frames(self):
+        sr = 44100
+        np.random.seed(5)
+        x = gen_harmonic(sr=sr, nsamp=sr/4) + .01*np.random.randn(sr/4)
+        mypv = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        ss = mypv.toSinSum()
+        start = ss.partial.start
+        npts = ss.partial.npts
+        for extra in [0, 1]:
+            for frst in range(0, mypv.nframes, 7):
+                pno, pts, frame = ss.get_points_in_frames(frst, frst + 7,
+                                                          minframes=3,
+                                                          extra=extra)
+                exp = [(fr, pidx) for pidx in range(len(ss.partial))
+                       if npts[pidx] >= 3
+                       for fr in range(start[pidx],
+                                       start[pidx] + npts[pidx] + extra)
+                       if frst <= fr < frst + 7]
+                self.assertEqual(zip(frame, pno), sorted(exp))
+                np.testing.assert_array_equal(pts, frame - start[pno])
+
+    def test_partial_end_moved(self):
+        ss = pv.SinSum(44100, nfft=1024, hop=256)
+        ss.add_empty_partial(2)
+        ss.add_empty_partial(4)
+        ss.set_partial_end(0, 6)
+        ss.set_partial_end(1, 5)
+        np.testing.assert_array_equal(ss.get_partials_idx_at_frame(5),
+                                      [0, 1])
+        ss.set_partial_end(0, 3)
+        np.testing.assert_array_equal(ss.get_partials_idx_at_frame(3), [0])
+        np.testing.assert_array_equal(ss.get_partials_idx_at_frame(5), [1])
+        self.assertEqual(len(ss.get_partials_idx_at_frame(6)), 0)
+
+
+class testPartialMatching(unittest.TestCase):
+    def test_greedy(self):
+        cost = np.array([[.1, .05, 2.],
+                         [.2, .3, 3.],
+                         [.01, .02, .03],
+                         [1., 1., 1.]])
+        col = pv.match_greedy(cost, .5)
+        np.testing.assert_array_equal(col, [1, 0, 2, -1])
+
+    def test_hungarian_minimises_total_cost(self):
+        cost = np.array([[.1, .2],
+                         [.15, .9]])
+        np.testing.assert_array_equal(pv.match_greedy(cost, .5), [0, -1])
+        np.testing.assert_array_equal(pv.match_hungarian(cost, .5), [1, 0])
+
+    def test_hungarian_gate(self):
+        cost = np.array([[.1, .6],
+                         [.7, .8]])
+        np.testing.assert_array_equal(pv.match_hungarian(cost, .5), [0, -1])
+
+    def test_sinsum_hungarian(self):
+        sr = 44100
+        x = gen_harmonic(sr=sr, nsamp=sr/4)
+        mypv = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        s1 = mypv.toSinSum()
+        s2 = mypv.toSinSum(match='hungarian')
+        self.assertEqual(len(s1.partial), len(s2.partial))
+        for p1, p2 in zip(s1.partial, s2.partial):
+            np.testing.assert_array_equal(p1.f, p2.f)
+
+
+class testPartialStore(unittest.TestCase):
+    def test_columns(self):
+        store = pv.PartialStore(capacity=4)
+        p0 = store.add_partial(3)
+        p1 = store.add_partial(4)
+        store.append_points([p0], 3, [100.], [1.], [0.])
+        store.append_points([p1, p0], 4, [200., 101.], [2., 1.5], [.2, .1])
+        store[p1].append_point(201., 3., .3, realph=7.)
+        store[p0].prepend_point(99., .5, -.1)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store[0].start_idx, 2)
+        np.testing.assert_array_equal(store[0].f, [99., 100., 101.])
+        np.testing.assert_array_equal(store[1].realph, [.2, 7.])
+        np.testing.assert_array_equal(store.get_offsets(), [0, 3, 5])
+        np.testing.assert_array_equal(store.last_f, [101., 201.])
+        np.testing.assert_array_equal(store.get_column('frame'),
+                                      [2, 3, 4, 4, 5])
+        self.assertEqual(store[1].get_freq_at_frame(5), 201.)
+        self.assertEqual(store[0].get_mag_at_frame(3), 1.)
+
+    def test_mixed_appends_and_reads(self):
+        np.random.seed(4)
+        store = pv.PartialStore(capacity=1)
+        ref = []
+        for ii in range(500):
+            if len(ref) == 0 or np.random.rand() < .1:
+                store.add_partial(ii)
+                ref.append([])
+            pno = np.random.randint(len(ref))
+            if np.random.rand() < .1:
+                store.prepend_point(pno, float(ii), 1., 0.)
+                ref[pno].insert(0, float(ii))
+            else:
+                store.append_points([pno], None, [float(ii)], [1.], [0.])
+                ref[pno].append(float(ii))
+            np.testing.assert_array_equal(store[pno].f, ref[pno])
+        for pno, vals in enumerate(ref):
+            np.testing.assert_array_equal(store[pno].f, vals)
+        np.testing.assert_array_equal(store.get_column('f'),
+                                      np.concatenate(ref))
+
+    def test_partial_view_slots(self):
+        store = pv.PartialStore()
+        store.add_partial(0)
+        part = store[0]
+        self.assertIsInstance(part, pv.RegPartial)
+        self.assertRaises(AttributeError, setattr, part, 'other', 1)
+
+    def test_summary_same_as_loop(self):
+        sr = 44100
+        np.random.seed(2)
+        x = gen_harmonic(sr=sr, nsamp=sr/4) + .01*np.random.randn(sr/4)
+        mypv = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        ss = mypv.toSinSum()
+        avf = np.array([np.mean(pp.f) for pp in ss.partial])
+        avmag = np.array([np.mean(pp.mag) for pp in ss.partial])
+        np.testing.assert_allclose(ss.get_avfreq(), avf, rtol=1e-12)
+        np.testing.assert_allclose(ss.get_avmag(), avmag, rtol=1e-12)
+        summ = ss.get_summary(minlen=3)
+        nlong = sum([len(pp.f) > 3 for pp in ss.partial])
+        self.assertEqual(len(summ), nlong)
+        self.assertTrue(np.all(np.diff(summ['mag']) >= 0))
+        np.testing.assert_allclose(summ['f'], avf[summ['idx']], rtol=1e-6)
+
+
+class testPartialSynth(unittest.TestCase):
+    def setUp(self):
+        sr = 44100
+        np.random.seed(3)
+        x = gen_harmonic(sr=sr, nsamp=sr/4) + .001*np.random.randn(sr/4)
+        self.sr = sr
+        self.x = x
+        self.pv = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        self.ss = self.pv.toSinSum()
+
+    def test_synth_same_as_loop(self):
+        for part in self.ss.partial:
+            if len(part.f) == 0:
+                continue
+            sig, st = part.synth(self.sr, 256)
+            sigl, stl = partial_synth_loop(part, self.sr, 256)
+            self.assertEqual(st, stl)
+            np.testing.assert_array_equal(sig, sigl)
+
+    def test_add_synth(self):
+        part = max(self.ss.partial, key=len)
+        sig, st = part.synth(self.sr, 256, edge=1.)
+        out = np.zeros(len(sig) + 100)
+        part.add_synth(out, self.sr, 256, edge=1., offset=10-st)
+        np.testing.assert_array_equal(out[10:10+len(sig)], sig)
+        # samples outside the buffer are dropped
+        out = np.zeros(50)
+        part.add_synth(out, self.sr, 256, edge=1., offset=-st-20)
+        np.testing.assert_array_equal(out, sig[20:70])
+
+    def test_bank_same_as_partial(self):
+        for minframes, edge, hop in [(3, 1., 256), (1, .5, 256), (3, 0., 128)]:
+            w1 = self.ss.synth(self.sr, hop, edge=edge, minframes=minframes)
+            for blocksize in [1, 5, 64]:
+                w2 = self.ss.synth(self.sr, hop, edge=edge,
+                                   minframes=minframes, method='bank',
+                                   blocksize=blocksize)
+                np.testing.assert_allclose(w1, w2, atol=1e-12)
+
+    def test_synth_no_partials(self):
+        ss = pv.SinSum(self.sr, nfft=1024, hop=256)
+        self.assertEqual(ss.get_synth_length(256), 0)
+        for method in ['partial', 'bank', 'ifft']:
+            self.assertEqual(len(ss.synth(self.sr, 256, method=method)), 0)
+        self.assertEqual(len(list(ss.synth_stream(self.sr, 256))), 0)
+        self.assertRaises(ValueError, ss.synth, self.sr, 256,
+                          method='other')
+        for method in ['bank', 'ifft']:
+            self.assertRaises(ValueError, ss.synth, self.sr, 256,
+                              method=method, phase_preserve=False)
+
+    def test_interp_segments(self):
+        vals = np.array([1., 2., 4., 3., 7., 5.])
+        base = np.array([0, 3, 5])
+        nvals = np.array([3, 2, 1])
+        pos0 = np.array([-.7, .6, 2.])
+        res = pv.interp_segments(vals, base, nvals, pos0, 5, .25)
+        for row in range(3):
+            seg = vals[base[row]:base[row] + nvals[row]]
+            pos = pos0[row] + .25*np.arange(5)
+            np.testing.assert_allclose(res[row],
+                                       np.interp(pos, np.arange(len(seg)),
+                                                 seg))
+
+    def test_hann_lobe_table(self):
+        table = pv.hann_lobe_table(512, nlobe=2, oversamp=4)
+        self.assertEqual(len(table), 17)
+        np.testing.assert_allclose(table[::4], [0., 128., 256., 128., 0.],
+                                   atol=1e-9)
+
+    def test_ifft_close_to_partial(self):
+        sr = self.sr
+        t = np.arange(sr/2)/float(sr)
+        x = .1*np.sin(2*np.pi*440*t + .3) + .05*np.sin(2*np.pi*1330.7*t)
+        mypv = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        ss = mypv.toSinSum()
+        w1 = ss.synth(sr, 256)
+        w2 = ss.synth(sr, 256, method='ifft', blocksize=5)
+        self.assertEqual(len(w1), len(w2))
+        rms = np.sqrt(np.mean(w1[2048:-2048]**2))
+        err = np.sqrt(np.mean((w1 - w2)[2048:-2048]**2))
+        self.assertLess(err, .03*rms)
+        # wider lobes are more accurate
+        w3 = np.zeros(len(w1) + 256)
+        for st, sig in ss.synth_ifft_blocks(sr, 256, nlobe=4):
+            w3[st+256:st+256+len(sig)] += sig
+        err4 = np.sqrt(np.mean((w1 - w3[256:])[2048:-2048]**2))
+        self.assertLess(err4, err/2)
+
+    def test_ifft_error_on_recording(self):
+        # accuracy documented in SinSum.synth_ifft_blocks
+        sr, x = su.WavMemmap(os.path.join(EXAMPLES, 'perlmanVn.wav'))
+        x = x[:3*sr]
+        mypv = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        ss = mypv.toSinSum()
+        w1 = ss.synth(sr, 256)
+        w2 = ss.synth(sr, 256, method='ifft')
+        self.assertEqual(len(w1), len(w2))
+        err = np.sqrt(np.mean((w1 - w2)**2)/np.mean(w1**2))
+        self.assertLess(err, .14)
+
+    def test_stream_same_as_synth(self):
+        nsamp = self.ss.get_synth_length(256)
+        for method in ['bank', 'ifft']:
+            w = self.ss.synth(self.sr, 256, method=method)
+            self.assertEqual(len(w), nsamp)
+            for blocklen, blocksize in [(1000, None), (4096, 3), (100, 20)]:
+                blocks = list(self.ss.synth_stream(self.sr, 256,
+                                                   blocklen=blocklen,
+                                                   method=method,
+                                                   blocksize=blocksize))
+                for blk in blocks[:-1]:
+                    self.assertEqual(len(blk), blocklen)
+                np.testing.assert_allclose(np.concatenate(blocks), w,
+                                           atol=1e-12)
+
+    def test_sinsum_synth(self):
+        w = self.ss.synth(self.sr, 256)
+        rms = np.sqrt(np.mean(w[2048:-2048]**2))
+        self.assertAlmostEqual(rms, np.sqrt(np.mean(self.x**2)), places=2)
+
+
+class testPVSinSum(unittest.TestCase):
+    def test_fused_same_as_two_pass(self):
+        sr = 44100
+        np.random.seed(4)
+        x = gen_harmonic(sr=sr, nsamp=sr/2) + .01*np.random.randn(sr/2)
+        p1 = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        s1 = p1.toSinSum()
+        p2 = pv.PV(x, sr, nfft=1024, hop=256)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            s2 = p2.run_pv_sinsum()
+        self.assertEqual(len(p2.f), 0)
+        self.assertEqual(p2.nframes, p1.nframes)
+        np.testing.assert_array_equal(p2.t, p1.t)
+        self.assertEqual(len(s1.partial), len(s2.partial))
+        np.testing.assert_array_equal(s1.partial.start, s2.partial.start)
+        for field in ['f', 'mag', 'ph', 'realph']:
+            np.testing.assert_array_equal(s1.partial.get_column(field),
+                                          s2.partial.get_column(field))
+
+
+class testPeakFrames(unittest.TestCase):
+    def test_dense(self):
+        frames = [([100., 200.], [1., 2.], [.1, .2], [.1, .2], [2, 4]),
+                  ([], [], [], [], []),
+                  ([300.], [3.], [.3], [1.3], [6])]
+        pk = pv.PeakFrames.from_frames(frames, npeaks=3)
+        self.assertEqual(len(pk), 3)
+        np.testing.assert_array_equal(pk.get_count(), [2, 0, 1])
+        np.testing.assert_array_equal(pk.get_frame_index(), [0, 0, 2])
+        np.testing.assert_array_equal(pk.dense('f'), [[100., 200., 0.],
+                                                      [0., 0., 0.],
+                                                      [300., 0., 0.]])
+        np.testing.assert_array_equal(pk.dense('realph')[2], [1.3, 0., 0.])
+        np.testing.assert_array_equal(pk.get_frame(2)['binno'], [6])
+        self.assertEqual(len(pk.get_frame(1)), 0)
+
+    def test_concatenate(self):
+        p1 = pv.PeakFrames.from_arrays([1, 2], [1., 2., 3.], [1., 1., 1.],
+                                       [0., 0., 0.])
+        p2 = pv.PeakFrames.from_arrays([0, 1], [4.], [1.], [0.])
+        pk = pv.PeakFrames.concatenate([p1, p2])
+        np.testing.assert_array_equal(pk.offsets, [0, 1, 3, 3, 4])
+        np.testing.assert_array_equal(pk.peaks['f'], [1., 2., 3., 4.])
+        self.assertEqual(pk.npeaks, 2)
+
+    def test_pv_peaks(self):
+        sr = 44100
+        x = gen_harmonic(sr=sr, nsamp=sr/4)
+        mypv = run_pv_quiet(pv.PV(x, sr, nfft=1024, hop=256))
+        self.assertEqual(mypv.f.shape, (mypv.nframes, mypv.npeaks))
+        count = np.sum(mypv.f > 0, axis=1)
+        np.testing.assert_array_equal(mypv.peaks.get_count(), count)
+        t, f, mag = mypv.get_peak_points()
+        self.assertEqual(len(t), np.sum(count))
+        self.assertTrue(np.all(mag > 0))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import os
+import tempfile
+import unittest
+import warnings
+import numpy as np
+
+import PVAnalysis as pv
+import PVFile
+
+
+class testPVFile(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.pvf')
+        os.close(fd)
+        sr = 44100
+        t = np.arange(sr/2)/float(sr)
+        x = .1*np.sin(2*np.pi*400*t) + .05*np.sin(2*np.pi*1200*t)
+        self.pv = pv.PV(x, np.int64(sr), nfft=1024, hop=256)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.pv.run_pv()
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_save_load(self):
+        PVFile.save_pv(self.filename, self.pv)
+        p2 = PVFile.load_pv(self.filename)
+        self.assertEqual(p2.sr, self.pv.sr)
+        self.assertEqual(p2.nframes, self.pv.nframes)
+        np.testing.assert_array_equal(p2.win, self.pv.win)
+        for field in ['t', 'f', 'mag', 'ph', 'realph', 'binno']:
+            np.testing.assert_array_equal(getattr(p2, field),
+                                          getattr(self.pv, field))
+
+    def test_frame_range(self):
+        PVFile.save_pv(self.filename, self.pv)
+        pvf = PVFile.PVFile(self.filename)
+        self.assertEqual(len(pvf), self.pv.nframes)
+        np.testing.assert_array_equal(pvf.get_dense('mag', 10, 20),
+                                      self.pv.mag[10:20])
+        np.testing.assert_array_equal(pvf.get_time(10, 20), self.pv.t[10:20])
+        frames = pvf.get_frames(5, 6)
+        self.assertEqual(len(frames), 1)
+        self.assertIsInstance(frames.peaks, np.memmap)
+        self.assertEqual(len(pvf.get_frames(30, 30)), 0)
+
+    def test_not_analysed(self):
+        p2 = pv.PV(np.zeros(4096), 44100, nfft=1024, hop=256)
+        self.assertRaises(ValueError, PVFile.save_pv, self.filename, p2)
+        self.assertRaises(ValueError, p2.get_peak_points)
+
+    def test_not_a_pv_file(self):
+        PVFile.write_arrays(self.filename, 'other', {}, dict(a=np.arange(3)))
+        self.assertRaises(ValueError, PVFile.PVFile, self.filename)
+        af = PVFile.ArrayFile(self.filename)
+        np.testing.assert_array_equal(af.get_array('a'), np.arange(3))
+        with open(self.filename, 'wb') as f:
+            f.write(b'not a container file')
+        self.assertRaises(ValueError, PVFile.ArrayFile, self.filename)
+
+
+class testSinSumFile(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.pvf')
+        os.close(fd)
+        sr = 44100
+        np.random.seed(6)
+        t = np.arange(sr)/float(sr)
+        x = (.1*np.sin(2*np.pi*440*t) * (t < .6) +
+             .05*np.sin(2*np.pi*1200*t) * (t > .3) +
+             .001*np.random.randn(len(t)))
+        mypv = pv.PV(x, sr, nfft=1024, hop=256)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.ss = mypv.run_pv_sinsum()
+        PVFile.save_sinsum(self.filename, self.ss)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_find_same_as_scan(self):
+        ssf = PVFile.SinSumFile(self.filename)
+        self.assertEqual(len(ssf), len(self.ss.partial))
+        avf = self.ss.get_avfreq()
+        avmag = self.ss.get_avmag()
+        st = self.ss.partial.start
+        end = np.array(self.ss.end)
+        hop = self.ss.hop/float(self.ss.sr)
+        for fmin, fmax, tmin, tmax, minmag in [
+                (400, 480, None, None, None), (1000, 1300, .7, .9, None),
+                (400, 480, .7, .9, None), (None, None, .1, .2, .01),
+                (None, 500, None, .05, None)]:
+            keep = np.ones(len(avf), dtype=bool)
+            if fmin is not None:
+                keep &= avf > fmin
+            if fmax is not None:
+                keep &= avf < fmax
+            if tmin is not None:
+                keep &= end*hop >= tmin
+            if tmax is not None:
+                keep &= st*hop <= tmax
+            if minmag is not None:
+                keep &= avmag > minmag
+            np.testing.assert_array_equal(
+                ssf.find_partials(fmin, fmax, tmin, tmax, minmag),
+                np.flatnonzero(keep))
+
+    def test_find_band_edges(self):
+        ssf = PVFile.SinSumFile(self.filename)
+        avf = self.ss.get_avfreq()
+        idx = ssf.find_partials_around_freq(440.)
+        self.assertGreater(len(idx), 0)
+        # partials exactly at a band edge are excluded
+        for pidx in idx:
+            self.assertNotIn(pidx, ssf.find_partials(fmin=avf[pidx]))
+            self.assertNotIn(pidx, ssf.find_partials(fmax=avf[pidx]))
+            self.assertIn(pidx, ssf.find_partials(fmin=avf[pidx] - 1e-6,
+                                                  fmax=avf[pidx] + 1e-6))
+
+    def test_part_data_around_freq(self):
+        ssf = PVFile.SinSumFile(self.filename)
+        t1, f1, mag1, ph1 = self.ss.get_part_data_around_freq(440.)
+        t2, f2, mag2, ph2 = ssf.get_part_data_around_freq(440.)
+        np.testing.assert_array_equal(t1, t2)
+        np.testing.assert_array_equal(f1, f2)
+        np.testing.assert_array_equal(mag1, mag2)
+        t3, f3, mag3, ph3 = ssf.get_part_data_around_freq(440., tmin=.2,
+                                                          tmax=.4)
+        sel = np.logical_and(t1 >= .2, t1 <= .4)
+        np.testing.assert_array_equal(t3, t1[sel])
+        np.testing.assert_array_equal(f3, f1[sel])
+
+    def test_load(self):
+        ssf = PVFile.SinSumFile(self.filename)
+        idx = ssf.find_partials_around_freq(1200.)[0]
+        part = ssf.get_partial(idx)
+        np.testing.assert_array_equal(part.f, self.ss.partial[idx].f)
+        self.assertEqual(part.start_idx, self.ss.partial[idx].start_idx)
+
+        ss2 = PVFile.load_sinsum(self.filename)
+        self.assertEqual(ss2.end, self.ss.end)
+        for fr in [0, 10, 50]:
+            np.testing.assert_array_equal(
+                ss2.get_partials_idx_at_frame(fr),
+                self.ss.get_partials_idx_at_frame(fr))
+        np.testing.assert_array_equal(ss2.synth(44100, 256),
+                                      self.ss.synth(44100, 256))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,44 @@ def parabolic_peak(max_pos=1.0, max_val=1.0, n=3, a=-1.):
     return a*x*x + b*x + c
 
 
+def findpos_loop(x, npeaks, minamp):
+    # peak selection one peak at a time
+    minx = np.min(x)
+    peakmask = (x[0:-2] < x[1:-1])*(x[1:-1] >= x[2:]).astype(int)
+    pkmskamp = peakmask*(x[1:-1]-minx)
+    th = minamp - minx
+    pos = []
+    while len(pos) < npeaks and pkmskamp.max() > th:
+        b = pkmskamp.argmax()
+        pos.append(b + 1)
+        pkmskamp[b] = th-1
+    return pos
+
+
+def salience_loop(x, pos, val, rad):
+    keep = np.ones(len(pos), dtype=bool)
+    for idx in range(len(pos)):
+        wmin = max(pos[idx]-rad, 1)
+        wmax = min(pos[idx] + rad, len(x))
+        if any(x[wmin:wmax + 1] > val[idx]):
+            keep[idx] = False
+    return keep
+
+
+def boundaries_loop(x, pos):
+    prevb = np.argmin(x[0:pos[0]])
+    bounds = []
+    spos = np.sort(pos)
+    for i in range(len(spos)):
+        if i < len(spos)-1:
+            nextb = np.argmin(x[spos[i]:spos[i + 1]]) + spos[i]
+        else:
+            nextb = len(x)-1
+        bounds.append([prevb, nextb])
+        prevb = nextb
+    return bounds
+
+
 class testPeakFinder(unittest.TestCase):
     def testFindOnePeak(self):
         x = np.linspace(0, 1, 10)
@@ -19,6 +57,17 @@ class testPeakFinder(unittest.TestCase):
         assert(len(peaks.pos) == 1)
         self.assertEqual(peaks.pos, 9)
 
+    def test_findpos_same_as_loop(self):
+        np.random.seed(0)
+        for npeaks in [1, 5, 20, 200]:
+            # quantised values to include equal peaks
+            x = np.round(np.random.rand(500)*10)
+            minamp = 3.
+            peaks = pf.PeakFinder(x, npeaks=npeaks, minval=minamp)
+            peaks.findpos()
+            self.assertListEqual(peaks.pos.tolist(),
+                                 findpos_loop(x, npeaks, minamp))
+
     def test_refine_one_peak_centered(self):
         x = parabolic_peak(max_pos=1.0)
         peaks = pf.PeakFinder(x)
@@ -48,6 +97,99 @@ class testPeakFinder(unittest.TestCase):
         self.assertAlmostEqual(peaks.fpos[0], mypos)
 
 
+    def test_salience_and_boundaries_same_as_loop(self):
+        np.random.seed(3)
+        x = np.round(np.random.rand(300)*10)
+        for rad in [1, 5, 400]:
+            peaks = pf.PeakFinder(x, npeaks=40)
+            keep = salience_loop(x, peaks.pos, peaks.val, rad)
+            peaks.filter_by_salience(rad=rad)
+            self.assertListEqual(peaks.keep.tolist(), keep.tolist())
+        # boundaries after sorting by amplitude
+        peaks = pf.PeakFinder(x, npeaks=40)
+        peaks.sort_ampl()
+        bounds = boundaries_loop(x, peaks.pos)
+        peaks.boundaries()
+        self.assertListEqual(peaks.bounds.tolist(), bounds)
+
+    def test_refine_all_same_as_refine(self):
+        np.random.seed(4)
+        x = np.random.rand(300) + .1
+        for logarithmic in [False, True]:
+            for rad in [1, 3]:
+                peaks = pf.PeakFinder(x)
+                peaks.refine_all(logarithmic=logarithmic, rad=rad)
+                if logarithmic:
+                    xvec = np.log10(x)
+                else:
+                    xvec = x
+                fpos = np.zeros(len(peaks.pos))
+                fval = np.zeros(len(peaks.pos))
+                for i in range(len(peaks.pos)):
+                    if rad > 1:
+                        fpos[i], fval[i] = peaks.refine_opt(i, xvec=xvec,
+                                                            rad=rad)
+                    else:
+                        fpos[i], fval[i] = peaks.refine(i, xvec=xvec)
+                if logarithmic:
+                    fval = 10**fval
+                np.testing.assert_allclose(peaks.fpos, fpos, rtol=1e-9)
+                np.testing.assert_allclose(peaks.fval, fval, rtol=1e-9)
+
+
+class testPeakFinder2D(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(2)
+        # quantised values to include equal peaks
+        self.x = np.round(np.random.rand(30, 200)*20)
+
+    def test_same_as_rows(self):
+        for npeaks in [3, 50]:
+            peaks2d = pf.PeakFinder2D(self.x, npeaks=npeaks, minrattomax=.3)
+            peaks2d.boundaries()
+            peaks2d.filter_by_salience(rad=5)
+            for row, xr in enumerate(self.x):
+                peaks = pf.PeakFinder(xr, npeaks=npeaks, minrattomax=.3)
+                peaks.boundaries()
+                peaks.filter_by_salience(rad=5)
+                npks = len(peaks.pos)
+                self.assertEqual(peaks2d.npks[row], npks)
+                valid = peaks2d.valid[row]
+                self.assertListEqual(peaks2d.pos[row, valid].tolist(),
+                                     peaks.pos.tolist())
+                self.assertListEqual(peaks2d.val[row, valid].tolist(),
+                                     peaks.val.tolist())
+                self.assertListEqual(peaks2d.keep[row, valid].tolist(),
+                                     peaks.keep.tolist())
+                self.assertListEqual(peaks2d.bounds[row, valid].tolist(),
+                                     peaks.bounds.tolist())
+                nkeep = peaks2d.get_count()[row]
+                self.assertListEqual(peaks2d.get_pos()[row, :nkeep].tolist(),
+                                     peaks.get_pos().tolist())
+
+    def test_row_thresholds(self):
+        minval = np.linspace(5, 19, self.x.shape[0])
+        peaks2d = pf.PeakFinder2D(self.x, minval=minval)
+        for row, xr in enumerate(self.x):
+            peaks = pf.PeakFinder(xr, minval=minval[row])
+            self.assertListEqual(peaks2d.pos[row, peaks2d.valid[row]].tolist(),
+                                 peaks.pos.tolist())
+
+    def test_no_rows(self):
+        peaks2d = pf.PeakFinder2D(np.zeros((0, 200)), npeaks=5)
+        peaks2d.boundaries()
+        peaks2d.filter_by_salience(rad=5)
+        self.assertEqual(peaks2d.get_count().shape, (0,))
+        self.assertEqual(peaks2d.get_pos().shape, (0, 0))
+        self.assertEqual(peaks2d.get_val().shape, (0, 0))
+
+    def test_no_peaks(self):
+        peaks2d = pf.PeakFinder2D(np.ones((4, 200)), npeaks=5)
+        peaks2d.boundaries()
+        peaks2d.filter_by_salience(rad=5)
+        self.assertListEqual(peaks2d.get_count().tolist(), [0]*4)
+        self.assertEqual(peaks2d.get_pos().shape, (4, 0))
+
 
 def main():
     unittest.main()
@@ -1,7 +1,12 @@
+import os
 import unittest
 import numpy as np
 
-from Periodicity import period_marks_corr, PeriodTimeSeries
+from Periodicity import period_marks_corr, PeriodTimeSeries, autocorr
+from Periodicity import amdf, asdf, PeriodSeries
+from SoundUtils import WavMemmap
+
+TESTDIR = os.path.dirname(os.path.abspath(__file__))
 
 
 def gen_sin(f=440, sr=48000, nsamp=4800):
@@ -21,6 +26,17 @@ class testPeriodicity(unittest.TestCase):
         p0 = period.get_preferred_period()
         self.assertAlmostEqual(sr/p0, f0, delta=1.0)
 
+    def test_single_period_sin_difference(self):
+        f0 = 500.
+        sr = 48000
+        nsam = 4800
+        x = gen_sin(f=f0, sr=sr, nsamp=nsam)
+        for method in ['amdf', 'asdf']:
+            pts = PeriodTimeSeries(x, sr=sr, method=method)
+            pts.per_at_index(nsam/2)
+            p0 = pts.periods[0].get_preferred_period()
+            self.assertAlmostEqual(sr/p0, f0, delta=1.0)
+
     def test_preferred_period_is_scalar(self):
         x = gen_sin()
         nsam = len(x)
@@ -31,6 +47,74 @@ class testPeriodicity(unittest.TestCase):
         self.assertIsInstance(p0, float)
 
 
+class testAutocorr(unittest.TestCase):
+    def test_autocorr_matches_correlate(self):
+        x = np.random.RandomState(0).randn(301)
+        xc = np.correlate(x, x, "full")[len(x)-1:]
+        np.testing.assert_allclose(autocorr(x), xc, atol=1e-10)
+        np.testing.assert_allclose(autocorr(x, maxlag=40), xc[:41],
+                                   atol=1e-10)
+
+    def test_window_norm_defined_lags(self):
+        x = gen_sin()
+        pts = PeriodTimeSeries(x, window=np.hanning(960), method='xcorr')
+        # the last lags of a hanning window have (almost) no overlap
+        self.assertLessEqual(pts.nwnorm, 958)
+        self.assertGreater(pts.nwnorm, 940)
+        self.assertEqual(len(pts.wnorm), 960)
+
+
+class testAmdfBaseline(unittest.TestCase):
+    def test_amdf_f0_same_as_baseline(self):
+        # f0 from the original implementation (AMDF over all lags)
+        ref = np.load(os.path.join(TESTDIR, 'data', 'perlmanVn_amdf_f0.npz'))
+        sr, x = WavMemmap(os.path.join(TESTDIR, '..', 'examples',
+                                       'perlmanVn.wav'))
+        x = np.asarray(x[:int(1.5*sr)])
+        for name, window in [('boxcar', None),
+                             ('hann', np.hanning(3*int(sr/80)))]:
+            ps = PeriodSeries(x, sr=sr, fmin=80, fmax=2000, method='amdf',
+                              window=window)
+            ps.calc()
+            np.testing.assert_allclose(ps.get_f0(), ref['f0_' + name],
+                                       rtol=1e-9)
+            np.testing.assert_allclose(ps.get_strength(),
+                                       ref['strength_' + name], atol=1e-9)
+
+
+class testDifferenceFunctions(unittest.TestCase):
+    def setUp(self):
+        self.x = np.random.RandomState(0).randn(500)
+
+    def test_amdf(self):
+        x = self.x
+        y = amdf(x, 3, 230, blocksize=16)
+        self.assertEqual(len(y), len(x))
+        self.assertTrue(np.all(y[:3] == 0))
+        self.assertTrue(np.all(y[230:] == 0))
+        for lag in [3, 17, 18, 229]:
+            ref = np.abs(x[:len(x)-lag] - x[lag:]).mean()
+            self.assertAlmostEqual(y[lag], ref)
+
+    def test_asdf(self):
+        x = self.x
+        y = asdf(x, 3, 230)
+        self.assertTrue(np.all(y[:3] == 0))
+        self.assertTrue(np.all(y[230:] == 0))
+        for lag in [3, 17, 229]:
+            ref = ((x[:len(x)-lag] - x[lag:])**2).mean()
+            self.assertAlmostEqual(y[lag], ref)
+
+    def test_all_lags(self):
+        x = self.x[:40]
+        ya = amdf(x)
+        ys = asdf(x)
+        for lag in range(len(x)):
+            diff = x[:len(x)-lag] - x[lag:]
+            self.assertAlmostEqual(ya[lag], np.abs(diff).mean())
+            self.assertAlmostEqual(ys[lag], (diff**2).mean())
+
+
 class testPeriodMarks(unittest.TestCase):
     def test_period_mark_corr_int_samples_per_period(self):
         sr = 1.0